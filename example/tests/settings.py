@@ -49,7 +49,6 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.locale.LocaleMiddleware',
-    'musette.middleware.ActiveUserMiddleware',
     'musette.middleware.RestrictStaffToAdminMiddleware'
 )
 
@@ -1,24 +1,35 @@
 from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.utils.functional import SimpleLazyObject
 
-from .models import Configuration
-from .utils import get_notifications
+from . import settings as localSettings
+from .notifications import load_snapshots
+from .realtime import get_current_stream_id
+from .utils import get_configuration, get_notifications
 
 
 def data_templates(request):
     """
-    context_processors for get in all templates
+    context_processors for get in all templates. The data
+    is got only when the template use it
     """
-    # Get notifications data
-    notifications = get_notifications(request.user.id)
+    def notifications():
+        # Only the last notifications for the header
+        if not request.user.is_authenticated():
+            return []
 
-    # Get configurations
-    try:
-        configurations = Configuration.objects.all()[:1].get()
-    except Configuration.DoesNotExist:
-        configurations = None
+        notif = get_notifications(request.user.id)
+        return load_snapshots(
+            list(notif[:localSettings.NOTIFICATIONS_LIMIT])
+        )
+
+    def configurations():
+        return get_configuration(get_current_site(request).id)
 
     return {
         'SETTINGS': settings,
-        'notifications': notifications,
-        'configurations': configurations
+        'notifications': SimpleLazyObject(notifications),
+        'configurations': SimpleLazyObject(configurations),
+        # Position of the streams of redis when the page is rendered
+        'stream_id': SimpleLazyObject(lambda: get_current_stream_id() or '')
     }
@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+
+from hitcount.models import BlacklistIP, BlacklistUserAgent, HitCount
+from hitcount.utils import get_ip
+
+from musette.utils import get_redis_connection
+
+# Hash hitcount pk -> hits not saved in the database
+HITS_PENDING = 'musette:hits:pending'
+# Hash with the hits that are being saved in the database
+HITS_FLUSHING = 'musette:hits:flushing'
+# Hits counted of each IP address in the period
+HITS_IP = 'musette:hits:ip:%s'
+
+# Max records for one update in the database
+FLUSH_CHUNK = 500
+
+
+def get_hit_timeout():
+    """
+    This method return the seconds of HITCOUNT_KEEP_HIT_ACTIVE
+    """
+    grace = getattr(settings, 'HITCOUNT_KEEP_HIT_ACTIVE', {'days': 7})
+    return int(timedelta(**grace).total_seconds())
+
+
+def exclude_hit(request):
+    """
+    This method return the message if the hit of the request not is
+    counted by the filters of django-hitcount, or None
+    """
+    ip = get_ip(request)
+    user_agent = request.META.get('HTTP_USER_AGENT', '')[:255]
+    if BlacklistIP.objects.filter(ip__exact=ip).exists():
+        return "Not counted: user IP has been blacklisted"
+    agents = BlacklistUserAgent.objects.filter(user_agent__exact=user_agent)
+    if agents.exists():
+        return "Not counted: user agent has been blacklisted"
+
+    exclude_user_group = getattr(settings, 'HITCOUNT_EXCLUDE_USER_GROUP', None)
+    if exclude_user_group and request.user.is_authenticated():
+        if request.user.groups.filter(name__in=exclude_user_group).exists():
+            return "Not counted: user excluded by group"
+
+    # Limit of hits of one IP address in the period
+    limit = getattr(settings, 'HITCOUNT_HITS_PER_IP_LIMIT', 0)
+    if limit:
+        hits = get_redis_connection().get(HITS_IP % ip)
+        if hits is not None and int(hits) >= limit:
+            return "Not counted: hits per IP address limit reached"
+
+    return None
+
+
+def count_hit(hitcount_pk, visitor, ip=None):
+    """
+    This method count in redis one hit of one visitor. The same
+    visitor is counted one time in the period of HITCOUNT_KEEP_HIT_ACTIVE.
+    With HITCOUNT_HITS_PER_IP_LIMIT the hits of the IP address are counted
+    """
+    timeout = get_hit_timeout()
+    if not getattr(settings, 'HITCOUNT_HITS_PER_IP_LIMIT', 0):
+        ip = None
+
+    r = get_redis_connection()
+    key = 'musette:hits:%s:%s' % (hitcount_pk, visitor)
+    if not r.set(key, 1, ex=timeout, nx=True):
+        return False
+
+    pipe = r.pipeline()
+    pipe.hincrby(HITS_PENDING, hitcount_pk, 1)
+    if ip is not None:
+        pipe.incr(HITS_IP % ip)
+    replies = pipe.execute()
+
+    # The period of the IP address start with its first hit
+    if ip is not None and replies[1] == 1:
+        r.expire(HITS_IP % ip, timeout)
+    return True
+
+
+def flush_hits():
+    """
+    This method save in the database the hits pending of redis.
+    Return the total of objects updated
+    """
+    r = get_redis_connection()
+
+    # If the previous flush was interrupted, save first it hits
+    if not r.exists(HITS_FLUSHING):
+        try:
+            r.rename(HITS_PENDING, HITS_FLUSHING)
+        except redis.ResponseError:
+            # There are not hits pending
+            return 0
+
+    # Group the objects by hits, for update all with the same query
+    groups = {}
+    for pk, hits in r.hgetall(HITS_FLUSHING).items():
+        groups.setdefault(int(hits), []).append(int(pk))
+
+    total = 0
+    for hits, pks in groups.items():
+        for i in range(0, len(pks), FLUSH_CHUNK):
+            chunk = pks[i:i + FLUSH_CHUNK]
+            with transaction.atomic():
+                HitCount.objects.filter(
+                    pk__in=chunk
+                ).update(hits=F('hits') + hits)
+
+            # Each chunk saved is removed, for not save it again if the
+            # flush is interrupted
+            r.hdel(HITS_FLUSHING, *chunk)
+            total += len(chunk)
+
+    return total
+
+
+def get_hits(model, ids):
+    """
+    This method return a dict id -> hits of many objects of one model
+    """
+    ctype = ContentType.objects.get_for_model(model)
+    hits = dict(
+        HitCount.objects.filter(
+            content_type=ctype, object_pk__in=ids
+        ).values_list('object_pk', 'hits')
+    )
+
+    return dict((pk, hits.get(pk, 0)) for pk in ids)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from musette.hits import flush_hits
+
+
+class Command(BaseCommand):
+    help = "Save in the database the hits of topics and forums of redis."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Seconds between each flush. If is 0, flush one time.'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+
+        while True:
+            total = flush_hits()
+            self.stdout.write('Objects updated: ' + str(total))
+
+            if not interval:
+                break
+            time.sleep(interval)
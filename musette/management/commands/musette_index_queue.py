@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from musette.search import process_queue
+
+
+class Command(BaseCommand):
+    help = "Index the topics and comments of the queue of redis."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--burst', action='store_true', default=False,
+            help='Exit when the queue is empty.'
+        )
+
+    def handle(self, *args, **options):
+        burst = options['burst']
+
+        while True:
+            total = process_queue()
+            if total is None:
+                if burst:
+                    break
+                time.sleep(1)
+            else:
+                self.stdout.write('Documents indexed: ' + str(total))
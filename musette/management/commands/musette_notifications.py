@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from musette.notifications import (
+    process_notifications, requeue_notifications
+)
+
+
+class Command(BaseCommand):
+    help = "Create the notifications of the queue of redis."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--burst', action='store_true', default=False,
+            help='Exit when the queue is empty.'
+        )
+
+    def handle(self, *args, **options):
+        burst = options['burst']
+
+        # The items of a worker stopped before create them
+        total = requeue_notifications()
+        if total:
+            self.stdout.write('Items returned to the queue: ' + str(total))
+
+        while True:
+            total = process_notifications(timeout=1 if burst else 0)
+            if total is None:
+                break
+            self.stdout.write('Notifications created: ' + str(total))
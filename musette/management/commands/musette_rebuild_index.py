@@ -0,0 +1,84 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from musette import search
+from musette import settings as localSettings
+from musette.models import Comment, Topic
+from musette.utils import get_redis_connection
+
+
+class Command(BaseCommand):
+    help = "Index again all the topics and comments for the search."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Continue the previous rebuild, after the last batch '
+                 'indexed.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=localSettings.SEARCH_BATCH_SIZE,
+            help='Documents indexed in each transaction.'
+        )
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        backend.setup()
+
+        # Last pk indexed of each model, saved after each batch
+        r = get_redis_connection()
+        if options['resume']:
+            checkpoint = dict(
+                (model.decode('utf-8'), int(pk))
+                for model, pk in r.hgetall(search.SEARCH_REBUILD).items()
+            )
+        else:
+            backend.clear()
+            r.delete(search.SEARCH_REBUILD)
+            checkpoint = {}
+
+        querysets = [
+            Topic.objects.only('idtopic', 'title', 'description'),
+            Comment.objects.only('idcomment', 'topic', 'description'),
+        ]
+        for queryset in querysets:
+            self.index_model(
+                backend, r, queryset, checkpoint.get(queryset.model.__name__),
+                options['batch_size']
+            )
+
+        r.delete(search.SEARCH_REBUILD)
+        self.stdout.write("Finished.")
+
+    def index_model(self, backend, r, queryset, last, batch_size):
+        name = queryset.model.__name__
+        if last is not None:
+            queryset = queryset.filter(pk__gt=last)
+
+        # The rows are read with a cursor, without load all in memory
+        total = 0
+        start = time.time()
+        batch = []
+        for instance in queryset.order_by('pk').iterator():
+            batch.append(search.get_document(instance))
+            if len(batch) == batch_size:
+                total += self.index_batch(backend, r, name, batch, instance.pk)
+                batch = []
+                self.report(name, total, start)
+        if batch:
+            total += self.index_batch(backend, r, name, batch, instance.pk)
+        self.report(name, total, start)
+
+    def index_batch(self, backend, r, name, batch, last):
+        with transaction.atomic():
+            backend.index(batch)
+        r.hset(search.SEARCH_REBUILD, name, last)
+        return len(batch)
+
+    def report(self, name, total, start):
+        elapsed = time.time() - start
+        self.stdout.write('%ss indexed: %d (%.0f/s)' % (
+            name, total, total / elapsed if elapsed else 0
+        ))
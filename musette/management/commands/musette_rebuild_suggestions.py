@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from musette.suggestions import rebuild
+
+
+class Command(BaseCommand):
+    help = "Index again the titles of the topics for the suggested topics."
+
+    def handle(self, *args, **options):
+        total = rebuild()
+        self.stdout.write('Topics indexed: ' + str(total))
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import (
+    Count, IntegerField, Max, Min, OuterRef, Subquery
+)
+from django.db.models.functions import Coalesce
+
+from musette.models import Comment, Forum, Topic, TopicParticipant
+
+
+class Command(BaseCommand):
+    help = "Recompute the counters of forums, topics and participants."
+
+    def handle(self, *args, **options):
+        self.recount_forums()
+        self.recount_topics()
+        self.recount_participants()
+        self.stdout.write("Finished.")
+
+    def recount_forums(self):
+        # Count the topics of each forum inside the same update
+        topics = Topic.objects.filter(
+            forum_id=OuterRef('idforum')
+        ).order_by().values('forum_id').annotate(
+            tot=Count('idtopic')
+        ).values('tot')
+
+        total = Forum.objects.update(
+            topics_count=Coalesce(
+                Subquery(topics, output_field=IntegerField()), 0
+            )
+        )
+
+        self.stdout.write('Forums updated: ' + str(total))
+
+    def recount_topics(self):
+        # Count the comments and get the last of each topic inside the
+        # same update, the comments added meanwhile are not lost
+        comments = Comment.objects.filter(
+            topic_id=OuterRef('idtopic')
+        ).order_by()
+        counters = comments.values('topic_id')
+        last = comments.order_by('-idcomment')
+
+        total = Topic.objects.update(
+            comments_count=Coalesce(Subquery(
+                counters.annotate(tot=Count('idcomment')).values('tot'),
+                output_field=IntegerField()
+            ), 0),
+            participants_count=Coalesce(Subquery(
+                counters.annotate(
+                    tot=Count('user', distinct=True)
+                ).values('tot'),
+                output_field=IntegerField()
+            ), 0),
+            last_comment=Subquery(last.values('idcomment')[:1]),
+            last_comment_user=Subquery(last.values('user_id')[:1]),
+            last_comment_date=Subquery(last.values('date')[:1])
+        )
+
+        self.stdout.write('Topics updated: ' + str(total))
+
+    def recount_participants(self):
+        # Get the comments of each user in each topic
+        participants = Comment.objects.order_by().values(
+            'topic_id', 'user_id'
+        ).annotate(
+            comments=Count('idcomment'), first=Min('date'), last=Max('date')
+        )
+
+        with transaction.atomic():
+            TopicParticipant.objects.all().delete()
+            TopicParticipant.objects.bulk_create([
+                TopicParticipant(
+                    topic_id=p['topic_id'], user_id=p['user_id'],
+                    first_comment_date=p['first'],
+                    last_comment_date=p['last'], comments_count=p['comments']
+                ) for p in participants.iterator()
+            ], batch_size=500)
+
+        self.stdout.write(
+            'Participants updated: ' + str(TopicParticipant.objects.count())
+        )
@@ -1,16 +1,80 @@
-import inspect
-import os
+from django.core.management.base import BaseCommand, CommandError
 
-from django.core.management.base import BaseCommand
+from musette.utils import REDIS_POOL
+from musette.websockets import server
+from musette.websockets.sendqueue import DROP, POLICIES
 
 
 class Command(BaseCommand):
     help = "Run server tornado web sockets."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--port', type=int, default=8888,
+            help='Port of the server.'
+        )
+        parser.add_argument(
+            '--address', default='',
+            help='Address of the server. By default all the interfaces.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of processes. If is 0, one for each cpu.'
+        )
+        parser.add_argument(
+            '--queue-size', type=int, default=100,
+            help='Maximum of messages pending of send to each client.'
+        )
+        parser.add_argument(
+            '--slow-policy', choices=POLICIES, default=DROP,
+            help='When the queue of one client is full: drop the oldest '
+                 'message, coalesce the messages or disconnect the client.'
+        )
+        parser.add_argument(
+            '--batch-window', type=int, default=0,
+            help='Milliseconds that the comments of one topic are sent '
+                 'together in one frame (for example 100). By default 0, '
+                 'each comment in one frame.'
+        )
+        parser.add_argument(
+            '--compression', action='store_true', default=False,
+            help='Compress the messages with permessage-deflate.'
+        )
+        parser.add_argument(
+            '--metrics-port', type=int, default=None,
+            help='First port of the metrics of each process. The worker N '
+                 'has its metrics in this port + N.'
+        )
+        parser.add_argument(
+            '--production', action='store_true', default=False,
+            help='Run without autoreload.'
+        )
+
     def handle(self, *args, **options):
+        workers = options['workers']
+        autoreload = not options['production']
+
+        # The autoreload only works with one process
+        if workers != 1 and autoreload:
+            raise CommandError("--workers requires --production")
+
         self.stdout.write('Running server...')
-        path = os.path.dirname(
-            os.path.abspath(inspect.getfile(inspect.currentframe())))
-        path = os.path.dirname(os.path.dirname(path))
         self.stdout.write('Tornado server initialized')
-        os.system("python " + path + "/websockets/server.py")
+        # Connection to redis of the settings
+        kwargs = REDIS_POOL.connection_kwargs
+        redis_options = {
+            'host': kwargs.get('host', 'localhost'),
+            'port': kwargs.get('port', 6379),
+            'password': kwargs.get('password'),
+            'db': int(kwargs.get('db') or 0)
+        }
+
+        server.run(
+            port=options['port'], address=options['address'],
+            workers=workers, autoreload=autoreload,
+            redis_options=redis_options, queue_size=options['queue_size'],
+            slow_policy=options['slow_policy'],
+            window=options['batch_window'],
+            compression=options['compression'],
+            metrics_port=options['metrics_port']
+        )
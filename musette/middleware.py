@@ -1,23 +1,22 @@
-from django.core.cache import cache
+import warnings
+
+from django.core.exceptions import MiddlewareNotUsed
 from django.core.urlresolvers import reverse
 from django.http import Http404
-from django.utils import timezone
-
-from . import settings
 
 
 class ActiveUserMiddleware(object):
     """
-    Set user authenticate
+    Deprecated, the users online are kept by the websocket server. It is
+    removed of the middlewares when django is started
     """
-    def process_request(self, request):
-        current_user = request.user
-        if request.user.is_authenticated():
-            now = timezone.now()
-            cache.set(
-                'seen_%s' % (current_user.username), now,
-                settings.USER_LASTSEEN_TIMEOUT
-            )
+    def __init__(self, get_response=None):
+        warnings.warn(
+            "musette.middleware.ActiveUserMiddleware is deprecated and does "
+            "nothing, remove it of MIDDLEWARE_CLASSES.",
+            DeprecationWarning
+        )
+        raise MiddlewareNotUsed
 
 
 class RestrictStaffToAdminMiddleware(object):
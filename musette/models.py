@@ -1,3 +1,4 @@
+import json
 import os
 
 from django.conf import settings
@@ -5,16 +6,13 @@ from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
-from django.core.cache import cache
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.shortcuts import get_object_or_404
 from django.template import defaultfilters
-from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.crypto import get_random_string
 from django.utils.translation import ugettext_lazy as _
 
-from . import settings as localSettings
 from .validators import valid_extension
 
 
@@ -217,6 +215,30 @@ class Topic(models.Model):
         _('Top'), default=False,
         help_text=_('If the topic is important and it will go top')
     )
+    comments_count = models.IntegerField(
+        _('Comments count'), blank=True, default=0, editable=False,
+    )
+    participants_count = models.IntegerField(
+        _('Participants count'), blank=True, default=0, editable=False,
+    )
+    last_comment = models.ForeignKey(
+        'Comment', related_name='+', verbose_name=_('Last comment'),
+        blank=True, null=True, editable=False, on_delete=models.SET_NULL
+    )
+    last_comment_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='+',
+        verbose_name=_('Last comment user'), blank=True, null=True,
+        editable=False, on_delete=models.SET_NULL
+    )
+    last_comment_date = models.DateTimeField(
+        _('Last comment date'), blank=True, null=True, editable=False
+    )
+
+    # Fields maintained with atomic updates, never written by save()
+    counter_fields = (
+        'comments_count', 'participants_count', 'last_comment',
+        'last_comment_user', 'last_comment_date',
+    )
 
     class Meta(object):
         ordering = ['forum', 'last_activity', 'title', 'date']
@@ -245,32 +267,82 @@ class Topic(models.Model):
         if exists_folder(path):
             remove_folder(path)
 
+        # The counter of the forum is updated by the signal post_delete
         Topic.objects.filter(idtopic=idtopic).delete()
-        self.update_forum_topics(self.forum, "subtraction")
 
     def save(self, *args, **kwargs):
+        created = not self.idtopic
 
-        if not self.idtopic:
+        if created:
             self.slug = defaultfilters.slugify(self.title)
-            self.update_forum_topics(self.forum, "sum")
 
         self.moderate = self.check_topic_moderate()
         self.generate_id_attachment(self.id_attachment)
-        super(Topic, self).save(*args, **kwargs)
-
-    def update_forum_topics(self, forum, action):
 
-        f = Forum.objects.get(name=forum)
-        tot_topics = f.topics_count
+        # Not overwrite the counters with stale values of this instance
+        if not self._state.adding and not kwargs.get('update_fields'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.counter_fields
+            ]
+
+        # The topic and the counter of the forum in the same transaction
+        with transaction.atomic():
+            super(Topic, self).save(*args, **kwargs)
+            if created:
+                self.update_forum_topics(self.forum_id, "sum")
+
+    def update_forum_topics(self, idforum, action):
+        """
+        Update atomically the counter of topics of one forum
+        """
         if action == "sum":
-            tot_topics = tot_topics + 1
+            tot_topics = models.F('topics_count') + 1
         elif action == "subtraction":
-            tot_topics = tot_topics - 1
+            tot_topics = models.F('topics_count') - 1
 
-        Forum.objects.filter(name=forum).update(
+        Forum.objects.filter(idforum=idforum).update(
             topics_count=tot_topics
         )
 
+    @classmethod
+    def update_comment_counters(cls, comment, action):
+        """
+        Update atomically the counters of the topic of one comment
+        """
+        topic = cls.objects.filter(idtopic=comment.topic_id)
+        if action == "sum":
+            # If is the first comment of the user in the topic
+            user = 1 if TopicParticipant.add_comment(comment) else 0
+            topic.update(
+                comments_count=models.F('comments_count') + 1,
+                participants_count=models.F('participants_count') + user,
+                last_comment=comment.idcomment,
+                last_comment_user=comment.user_id,
+                last_comment_date=comment.date
+            )
+        elif action == "subtraction":
+            # If was the last comment of the user in the topic
+            user = 1 if TopicParticipant.remove_comment(comment) else 0
+            topic.update(
+                comments_count=models.F('comments_count') - 1,
+                participants_count=models.F('participants_count') - user
+            )
+
+            # If was the last comment (set null on delete), get the previous
+            last = Comment.objects.filter(
+                topic_id=comment.topic_id
+            ).order_by('-idcomment').first()
+            if last:
+                topic.filter(last_comment__isnull=True).update(
+                    last_comment=last.idcomment,
+                    last_comment_user=last.user_id,
+                    last_comment_date=last.date
+                )
+            else:
+                topic.update(last_comment_user=None, last_comment_date=None)
+
     def check_topic_moderate(self):
         """
         Check if one topic is mark like moderate
@@ -292,6 +364,17 @@ class Topic(models.Model):
             self.id_attachment = get_random_string(length=32)
 
 
+def cascade_topic(collector, field, sub_objs, using):
+    """
+    Delete the comments of the topic deleted, marked for not update
+    the counters of the topic with each comment
+    """
+    sub_objs = list(sub_objs)
+    for comment in sub_objs:
+        comment._topic_deleted = True
+    models.CASCADE(collector, field, sub_objs, using)
+
+
 @python_2_unicode_compatible
 class Comment(models.Model):
     """
@@ -301,7 +384,7 @@ class Comment(models.Model):
     idcomment = models.AutoField(primary_key=True)
     topic = models.ForeignKey(
         Topic, related_name='topics', verbose_name=_('Topic'),
-        on_delete=models.CASCADE
+        on_delete=cascade_topic
     )
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, related_name='comment_users',
@@ -321,6 +404,91 @@ class Comment(models.Model):
         return str(self.description)
 
 
+@python_2_unicode_compatible
+class TopicParticipant(models.Model):
+    """
+    Model TopicParticipant, users that commented one topic
+    """
+    idparticipant = models.AutoField(primary_key=True)
+    topic = models.ForeignKey(
+        Topic, related_name='participants', verbose_name=_('Topic'),
+        on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='topic_participants',
+        verbose_name=_('User'), on_delete=models.CASCADE
+    )
+    first_comment_date = models.DateTimeField(_('First comment'))
+    last_comment_date = models.DateTimeField(_('Last comment'))
+    comments_count = models.PositiveIntegerField(
+        _('Comments'), default=0
+    )
+
+    class Meta(object):
+        unique_together = ('topic', 'user')
+        verbose_name = _('Participant')
+        verbose_name_plural = _('Participants')
+
+    def __str__(self):
+        return str(self.user_id)
+
+    @classmethod
+    def add_comment(cls, comment):
+        """
+        Add one comment to the participant of the topic.
+        Return True if the user is new in the topic
+        """
+        participant = cls.objects.filter(
+            topic_id=comment.topic_id, user_id=comment.user_id
+        )
+        if participant.update(
+            comments_count=models.F('comments_count') + 1,
+            last_comment_date=comment.date
+        ):
+            return False
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    topic_id=comment.topic_id, user_id=comment.user_id,
+                    first_comment_date=comment.date,
+                    last_comment_date=comment.date, comments_count=1
+                )
+        except IntegrityError:
+            # Other comment of the user created it in the meantime
+            participant.update(
+                comments_count=models.F('comments_count') + 1,
+                last_comment_date=comment.date
+            )
+            return False
+
+        return True
+
+    @classmethod
+    def remove_comment(cls, comment):
+        """
+        Remove one comment of the participant of the topic.
+        Return True if was the last comment of the user in the topic
+        """
+        participant = cls.objects.filter(
+            topic_id=comment.topic_id, user_id=comment.user_id
+        )
+        participant.update(comments_count=models.F('comments_count') - 1)
+
+        deleted, rows = participant.filter(comments_count__lte=0).delete()
+        if deleted:
+            return True
+
+        # Get the date of the last comment of the user
+        last_date = Comment.objects.filter(
+            topic_id=comment.topic_id, user_id=comment.user_id
+        ).aggregate(last=models.Max('date'))['last']
+        if last_date:
+            participant.update(last_comment_date=last_date)
+
+        return False
+
+
 @python_2_unicode_compatible
 class Notification(models.Model):
     """
@@ -337,6 +505,8 @@ class Notification(models.Model):
     is_comment = models.BooleanField(default=0)
     is_view = models.BooleanField(default=0)
     date = models.DateTimeField(blank=True, db_index=True)
+    # Json with the data for display the notification
+    payload = models.TextField(blank=True, default='', editable=False)
 
     class Meta(object):
         ordering = ['date']
@@ -344,6 +514,15 @@ class Notification(models.Model):
     def __str__(self):
         return str(self.idnotification)
 
+    def get_snapshot(self):
+        """
+        Return the data for display the notification, or None
+        """
+        if self.payload:
+            return json.loads(self.payload)
+        else:
+            return None
+
 
 @python_2_unicode_compatible
 class Register(models.Model):
@@ -401,18 +580,15 @@ class AbstractProfile(models.Model):
         return str(self.iduser.username)
 
     def last_seen(self):
-        return cache.get('seen_%s' % self.iduser.username)
+        # Get from redis only one time for each profile
+        if not hasattr(self, '_last_seen'):
+            from .presence import get_last_seen
+            self._last_seen = get_last_seen([self.iduser_id])[self.iduser_id]
+        return self._last_seen
 
     def online(self):
-        if self.last_seen():
-            now = timezone.now()
-            if now > self.last_seen() + timezone.timedelta(
-                         seconds=localSettings.USER_ONLINE_TIMEOUT):
-                return False
-            else:
-                return True
-        else:
-            return False
+        from .presence import is_online
+        return is_online(self.last_seen())
 
     class Meta:
         abstract = True
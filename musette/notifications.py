@@ -0,0 +1,289 @@
+import json
+import logging
+
+import redis
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from musette import settings as localSettings
+from musette.models import Comment, Notification, Topic
+from musette.utils import get_photos_profile, get_redis_connection
+
+# Key with the total of notifications not viewed of one user
+UNREAD_KEY = 'musette:notifications:unread:%s'
+
+# Queue with the notifications pending of create, added in the left
+NOTIFICATIONS_QUEUE = 'musette:notifications:queue'
+# Items of the queue that are being created by the worker
+NOTIFICATIONS_PROCESSING = 'musette:notifications:processing'
+# Hash item -> attempts of the items that failed
+NOTIFICATIONS_ATTEMPTS = 'musette:notifications:attempts'
+# Items that failed NOTIFICATIONS_MAX_ATTEMPTS times, not created
+NOTIFICATIONS_FAILED = 'musette:notifications:failed'
+
+NOTIFICATIONS_MAX_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+# Increment the counter only if exists, else it is recounted when is read
+INCR_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+
+def count_unread_notifications(iduser):
+    """
+    This method return the total of notifications not viewed
+    of one user from the database
+    """
+    return Notification.objects.filter(is_view=False, iduser=iduser).count()
+
+
+def get_unread_notifications(iduser):
+    """
+    This method return the total of notifications not viewed of one user.
+    If the counter not exists in redis, it is recounted from the database
+    """
+    try:
+        r = get_redis_connection()
+        total = r.get(UNREAD_KEY % iduser)
+        if total is None:
+            total = count_unread_notifications(iduser)
+            # If the counter was created meanwhile, it has the
+            # notifications added after the count
+            if not r.set(
+                UNREAD_KEY % iduser, total, nx=True,
+                ex=localSettings.NOTIFICATIONS_UNREAD_TIMEOUT
+            ):
+                total = r.get(UNREAD_KEY % iduser) or total
+    except redis.ConnectionError:
+        return count_unread_notifications(iduser)
+
+    return int(total)
+
+
+def add_unread_notifications(idusers):
+    """
+    This method add one notification not viewed to the counter of the users
+    """
+    r = get_redis_connection()
+    incr = r.register_script(INCR_IF_EXISTS)
+
+    pipe = r.pipeline(transaction=False)
+    for iduser in idusers:
+        incr(keys=[UNREAD_KEY % iduser], args=[1], client=pipe)
+
+    try:
+        pipe.execute()
+    except redis.ConnectionError:
+        # The counters are recounted when expire
+        pass
+
+
+def reset_unread_notifications(iduser):
+    """
+    This method set in zero the counter of notifications of one user
+    """
+    try:
+        r = get_redis_connection()
+        r.set(
+            UNREAD_KEY % iduser, 0,
+            ex=localSettings.NOTIFICATIONS_UNREAD_TIMEOUT
+        )
+    except redis.ConnectionError:
+        pass
+
+
+def clear_unread_notifications(idusers):
+    """
+    This method remove the counter of the users, for recount it
+    """
+    if idusers:
+        try:
+            r = get_redis_connection()
+            r.delete(*[UNREAD_KEY % iduser for iduser in idusers])
+        except redis.ConnectionError:
+            pass
+
+
+def make_snapshot(topic, user, photo):
+    """
+    This method return the data for display one notification of one
+    topic created or commented by one user
+    """
+    return json.dumps({
+        "topic": topic.title,
+        "idtopic": topic.idtopic,
+        "slug": topic.slug,
+        "forum": topic.forum.name,
+        "username": user.username,
+        "iduser": user.id,
+        "photo": photo
+    })
+
+
+def load_snapshots(notifications):
+    """
+    This method build the data of the notifications created before
+    of the snapshots, with one query for comments and one for topics
+    """
+    notif = [n for n in notifications if not n.payload and n.idobject]
+    if not notif:
+        return notifications
+
+    ids_comments = [n.idobject for n in notif if n.is_comment]
+    ids_topics = [n.idobject for n in notif if not n.is_comment]
+
+    # Get topics and user of the objects of the notifications
+    objects = {}
+    if ids_comments:
+        comments = Comment.objects.filter(
+            idcomment__in=ids_comments
+        ).select_related('topic__forum', 'user')
+        for comment in comments:
+            objects[(True, comment.idcomment)] = (comment.topic, comment.user)
+    if ids_topics:
+        topics = Topic.objects.filter(
+            idtopic__in=ids_topics
+        ).select_related('forum', 'user')
+        for topic in topics:
+            objects[(False, topic.idtopic)] = (topic, topic.user)
+
+    photos = get_photos_profile([user.id for t, user in objects.values()])
+    for notification in notif:
+        key = (bool(notification.is_comment), notification.idobject)
+        if key in objects:
+            topic, user = objects[key]
+            notification.payload = make_snapshot(topic, user, photos[user.id])
+
+    return notifications
+
+
+def create_notifications(idusers, idobject, is_comment, payload, date):
+    """
+    This method create in batches the notifications
+    of one topic or comment for the users
+    """
+    model = Comment if is_comment else Topic
+    content_type = ContentType.objects.get_for_model(model)
+
+    Notification.objects.bulk_create([
+        Notification(
+            iduser=iduser, is_view=False, idobject=idobject, date=date,
+            is_topic=not is_comment, is_comment=is_comment,
+            content_type=content_type, payload=payload
+        ) for iduser in idusers
+    ], batch_size=localSettings.NOTIFICATIONS_BATCH_SIZE)
+
+    # The counters are recounted of the database, only with the
+    # notifications committed
+    transaction.on_commit(lambda: add_unread_notifications(idusers))
+
+
+def enqueue_notifications(data):
+    """
+    This method add the notifications to the queue of the worker.
+    If redis is down, they are created now
+    """
+    try:
+        r = get_redis_connection()
+        r.lpush(NOTIFICATIONS_QUEUE, json.dumps(data, cls=DjangoJSONEncoder))
+    except redis.ConnectionError:
+        create_notifications(**data)
+
+
+def send_notifications(idusers, obj, payload, date):
+    """
+    This method send the notifications of one topic or comment.
+    With MUSETTE_NOTIFICATIONS_ASYNC they are created by the worker
+    when the transaction is committed
+    """
+    if not idusers:
+        return
+
+    is_comment = isinstance(obj, Comment)
+    data = {
+        "idusers": list(idusers),
+        "idobject": obj.pk,
+        "is_comment": is_comment,
+        "payload": payload,
+        "date": date
+    }
+
+    if localSettings.NOTIFICATIONS_ASYNC:
+        transaction.on_commit(lambda: enqueue_notifications(data))
+    else:
+        create_notifications(**data)
+
+
+def process_notifications(timeout=0):
+    """
+    This method create the notifications of the first item of the queue,
+    waiting until timeout seconds. Return the total of notifications
+    created, or None if the queue is empty
+    """
+    r = get_redis_connection()
+
+    # The item is kept in the list of processing until it is created
+    item = r.brpoplpush(
+        NOTIFICATIONS_QUEUE, NOTIFICATIONS_PROCESSING, timeout
+    )
+    if item is None:
+        return None
+
+    try:
+        data = json.loads(item.decode('utf-8'))
+        data['date'] = parse_datetime(data['date'])
+
+        # If the object was removed before, not notify
+        model = Comment if data['is_comment'] else Topic
+        if model.objects.filter(pk=data['idobject']).exists():
+            create_notifications(**data)
+            total = len(data['idusers'])
+        else:
+            total = 0
+    except Exception:
+        logger.exception("Error creating the notifications of the queue")
+        fail_notifications(r, item)
+        return 0
+
+    pipe = r.pipeline()
+    pipe.lrem(NOTIFICATIONS_PROCESSING, 1, item)
+    pipe.hdel(NOTIFICATIONS_ATTEMPTS, item)
+    pipe.execute()
+    return total
+
+
+def fail_notifications(r, item):
+    """
+    This method return the item that failed to the end of the queue for
+    create it later. After NOTIFICATIONS_MAX_ATTEMPTS it is moved to the
+    list of failed
+    """
+    attempts = r.hincrby(NOTIFICATIONS_ATTEMPTS, item, 1)
+
+    pipe = r.pipeline()
+    if attempts < NOTIFICATIONS_MAX_ATTEMPTS:
+        pipe.lpush(NOTIFICATIONS_QUEUE, item)
+    else:
+        pipe.lpush(NOTIFICATIONS_FAILED, item)
+        pipe.hdel(NOTIFICATIONS_ATTEMPTS, item)
+    pipe.lrem(NOTIFICATIONS_PROCESSING, 1, item)
+    pipe.execute()
+
+
+def requeue_notifications():
+    """
+    This method return to the queue the items that were being created
+    when the worker was stopped. Return the total of items
+    """
+    r = get_redis_connection()
+    total = 0
+    while r.rpoplpush(NOTIFICATIONS_PROCESSING, NOTIFICATIONS_QUEUE):
+        total += 1
+    return total
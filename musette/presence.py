@@ -0,0 +1,74 @@
+import datetime
+import time
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from musette import settings as localSettings
+from musette.utils import get_redis_connection
+from musette.websockets.channels import PRESENCE_FORUM_KEY, PRESENCE_KEY
+
+
+def get_last_seen(idusers):
+    """
+    This method return the last time seen of the users
+    in one round trip to redis, None if not was seen
+    """
+    idusers = list(idusers)
+    try:
+        r = get_redis_connection()
+        pipe = r.pipeline(transaction=False)
+        for iduser in idusers:
+            pipe.zscore(PRESENCE_KEY, iduser)
+        scores = pipe.execute()
+    except redis.ConnectionError:
+        scores = [None] * len(idusers)
+
+    last_seen = {}
+    for iduser, score in zip(idusers, scores):
+        if score is None:
+            last_seen[iduser] = None
+        elif settings.USE_TZ:
+            last_seen[iduser] = datetime.datetime.fromtimestamp(
+                score, timezone.utc
+            )
+        else:
+            last_seen[iduser] = datetime.datetime.fromtimestamp(score)
+
+    return last_seen
+
+
+def is_online(last_seen):
+    """
+    This method return True if the last time seen is recent
+    """
+    if last_seen is None:
+        return False
+
+    timeout = datetime.timedelta(seconds=localSettings.USER_ONLINE_TIMEOUT)
+    return timezone.now() <= last_seen + timeout
+
+
+def get_online_users(idusers):
+    """
+    This method return the users online of the list
+    """
+    return set(
+        iduser for iduser, last_seen in get_last_seen(idusers).items()
+        if is_online(last_seen)
+    )
+
+
+def get_online_forum(idforum):
+    """
+    This method return the users online in one forum
+    """
+    since = time.time() - localSettings.USER_ONLINE_TIMEOUT
+    try:
+        r = get_redis_connection()
+        idusers = r.zrangebyscore(PRESENCE_FORUM_KEY % idforum, since, '+inf')
+    except redis.ConnectionError:
+        return []
+
+    return [int(iduser) for iduser in idusers]
@@ -0,0 +1,85 @@
+import json
+import logging
+import time
+
+import redis
+from django.db import transaction
+
+from musette import settings as localSettings
+from musette.utils import get_redis_connection
+from musette.websockets.channels import (
+    STREAM_KEY, TOPIC_CHANNEL, USER_CHANNEL
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Add the event to the stream of the channel and publish it with its id
+PUBLISH_EVENT = """
+local id = redis.call('xadd', KEYS[1], 'maxlen', '~', ARGV[2], '*',
+                      'data', ARGV[1])
+redis.call('expire', KEYS[1], ARGV[3])
+redis.call('publish', KEYS[2],
+           '{"stream_id": "' .. id .. '", ' .. string.sub(ARGV[1], 2))
+return id
+"""
+
+
+def get_current_stream_id():
+    """
+    This method return the id of the streams for the time of redis now.
+    The events after it are sent by the websocket server at connect
+    """
+    try:
+        seconds, microseconds = get_redis_connection().time()
+    except redis.RedisError:
+        return None
+    return '%d-0' % (seconds * 1000 + microseconds // 1000)
+
+
+def send_events(events):
+    """
+    This method publish the events (channel, message) in one round trip
+    """
+    r = get_redis_connection()
+    publish_event = r.register_script(PUBLISH_EVENT)
+
+    pipe = r.pipeline(transaction=False)
+    for channel, message in events:
+        publish_event(
+            keys=[STREAM_KEY % channel, channel],
+            args=[
+                message, localSettings.REALTIME_STREAM_LENGTH,
+                localSettings.REALTIME_STREAM_TIMEOUT
+            ],
+            client=pipe
+        )
+
+    try:
+        pipe.execute()
+    except redis.RedisError:
+        # The realtime is lost, the data is saved in the database. It is
+        # executed after the commit, the request not fails
+        logger.exception("Error publishing the events in redis")
+
+
+def publish(notification=None, idusers=(), comment=None, idtopic=None):
+    """
+    This method publish one notification in the channel of each user and
+    one comment in the channel of the topic, when the transaction is
+    committed
+    """
+    # For measure the latency in the websocket server
+    published = time.time()
+
+    events = []
+    if notification is not None:
+        notification = dict(notification, published=published)
+        message = json.dumps(notification)
+        events.extend((USER_CHANNEL % iduser, message) for iduser in idusers)
+    if comment is not None:
+        comment = dict(comment, published=published)
+        events.append((TOPIC_CHANNEL % idtopic, json.dumps(comment)))
+
+    if events:
+        transaction.on_commit(lambda: send_events(events))
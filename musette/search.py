@@ -0,0 +1,333 @@
+import logging
+import re
+from itertools import chain
+
+import redis
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+
+from musette import settings as localSettings
+from musette.models import Comment, Topic
+from musette.utils import get_redis_connection
+
+# Table of the index of search
+SEARCH_TABLE = 'musette_search'
+
+# Set with the ids of the documents pending of index
+SEARCH_QUEUE = 'musette:search:queue'
+# Hash model -> last pk indexed by musette_rebuild_index
+SEARCH_REBUILD = 'musette:search:rebuild'
+
+# Backends by vendor of the database
+BACKENDS = {
+    'sqlite': 'musette.search.SQLiteSearchBackend',
+    'postgresql': 'musette.search.PostgresSearchBackend',
+}
+
+WORDS = re.compile(r'\w+', re.UNICODE)
+
+backend = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_document_id(instance):
+    """
+    This method return the id of one topic or comment in the index.
+    The topics are even and the comments are odd
+    """
+    if isinstance(instance, Comment):
+        return instance.pk * 2 + 1
+    return instance.pk * 2
+
+
+def get_document(instance):
+    """
+    This method return the document (id, idtopic, title, body) of one
+    topic or comment
+    """
+    if isinstance(instance, Comment):
+        return (
+            get_document_id(instance), instance.topic_id, '',
+            strip_tags(instance.description)
+        )
+    return (
+        get_document_id(instance), instance.idtopic, instance.title,
+        strip_tags(instance.description)
+    )
+
+
+class BaseSearchBackend(object):
+    """
+    Backend of search. The documents are the topics and comments, the
+    results are the ids of the topics ordered by relevance
+    """
+    def setup(self):
+        """
+        Create the index if not exists
+        """
+        pass
+
+    def index(self, documents):
+        """
+        Add or replace the documents (id, idtopic, title, body)
+        """
+        raise NotImplementedError
+
+    def remove(self, ids):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def search(self, query, idforum, limit):
+        raise NotImplementedError
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Search without index, for the databases without full text search
+    """
+    def index(self, documents):
+        pass
+
+    def remove(self, ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, query, idforum, limit):
+        condition = Q()
+        for word in WORDS.findall(query):
+            condition &= (
+                Q(title__icontains=word) | Q(description__icontains=word) |
+                Q(topics__description__icontains=word)
+            )
+        topics = Topic.objects.filter(condition, forum_id=idforum)
+        return list(topics.order_by('-date').values_list(
+            'idtopic', flat=True
+        ).distinct()[:limit])
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Search with the extension FTS5 of SQLite, ordered by bm25
+    """
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS " + SEARCH_TABLE +
+                " USING fts5(title, body, topic_id UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 1')"
+            )
+
+    def index(self, documents):
+        documents = list(documents)
+        self.remove([document[0] for document in documents])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO " + SEARCH_TABLE +
+                " (rowid, topic_id, title, body) VALUES (%s, %s, %s, %s)",
+                documents
+            )
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM " + SEARCH_TABLE + " WHERE rowid = %s",
+                [(id,) for id in ids]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM " + SEARCH_TABLE)
+
+    def search(self, query, idforum, limit):
+        # Each word is a prefix, quoted for not use the syntax of fts5
+        words = ['"%s"*' % word for word in WORDS.findall(query)]
+        if not words:
+            return []
+
+        # bm25 only works in a subquery not flattened (with LIMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT s.topic_id, MIN(s.score) AS score FROM ("
+                "SELECT topic_id, bm25(" + SEARCH_TABLE + ", 10.0, 1.0) "
+                "AS score FROM " + SEARCH_TABLE + " WHERE " + SEARCH_TABLE +
+                " MATCH %s LIMIT -1) s INNER JOIN " + Topic._meta.db_table +
+                " t ON t.idtopic = s.topic_id WHERE t.forum_id = %s "
+                "GROUP BY s.topic_id ORDER BY score LIMIT %s",
+                [' '.join(words), idforum, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Search with tsvector and an index GIN of PostgreSQL, ordered
+    by ts_rank. The title weighs more than the text
+    """
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS " + SEARCH_TABLE + " ("
+                "id bigint PRIMARY KEY, topic_id integer NOT NULL, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS " + SEARCH_TABLE + "_document "
+                "ON " + SEARCH_TABLE + " USING GIN (document)"
+            )
+
+    def index(self, documents):
+        config = localSettings.SEARCH_CONFIG
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO " + SEARCH_TABLE + " (id, topic_id, document) "
+                "VALUES (%s, %s, setweight(to_tsvector(%s, %s), 'A') || "
+                "setweight(to_tsvector(%s, %s), 'B')) ON CONFLICT (id) "
+                "DO UPDATE SET topic_id = EXCLUDED.topic_id, "
+                "document = EXCLUDED.document",
+                [
+                    (id, idtopic, config, title, config, body)
+                    for id, idtopic, title, body in documents
+                ]
+            )
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM " + SEARCH_TABLE + " WHERE id = ANY(%s)",
+                [list(ids)]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute("TRUNCATE " + SEARCH_TABLE)
+
+    def search(self, query, idforum, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT s.topic_id, MAX(ts_rank(s.document, q)) AS score "
+                "FROM " + SEARCH_TABLE + " s INNER JOIN " +
+                Topic._meta.db_table + " t ON t.idtopic = s.topic_id, "
+                "plainto_tsquery(%s, %s) q WHERE s.document @@ q "
+                "AND t.forum_id = %s GROUP BY s.topic_id "
+                "ORDER BY score DESC LIMIT %s",
+                [localSettings.SEARCH_CONFIG, query, idforum, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def get_backend():
+    """
+    This method return the backend of the setting MUSETTE_SEARCH_BACKEND,
+    by default the backend of the database
+    """
+    global backend
+    if backend is None:
+        path = localSettings.SEARCH_BACKEND or BACKENDS.get(
+            connection.vendor, 'musette.search.DatabaseSearchBackend'
+        )
+        backend = import_string(path)()
+    return backend
+
+
+def index(instances):
+    """
+    This method add or replace the topics and comments in the index.
+    With MUSETTE_SEARCH_ASYNC they are indexed by the worker
+    """
+    if localSettings.SEARCH_ASYNC:
+        enqueue([get_document_id(instance) for instance in instances])
+    else:
+        update_index(
+            'index', [get_document(instance) for instance in instances]
+        )
+
+
+def remove(instances):
+    """
+    This method remove the topics and comments of the index.
+    With MUSETTE_SEARCH_ASYNC they are removed by the worker
+    """
+    ids = [get_document_id(instance) for instance in instances]
+    if localSettings.SEARCH_ASYNC:
+        enqueue(ids)
+    else:
+        update_index('remove', ids)
+
+
+def update_index(method, items):
+    """
+    This method index or remove the documents in a savepoint. If the
+    index fails, for example without the table of the index, the error
+    is logged and the topic or comment is saved
+    """
+    try:
+        with transaction.atomic():
+            getattr(get_backend(), method)(items)
+    except DatabaseError:
+        logger.exception("Error updating the index of search")
+
+
+def enqueue(ids):
+    """
+    This method add the documents to the queue of the worker when the
+    transaction is committed. If redis is down, they are updated then
+    """
+    def send():
+        try:
+            get_redis_connection().sadd(SEARCH_QUEUE, *ids)
+        except redis.ConnectionError:
+            update_documents(ids)
+
+    transaction.on_commit(send)
+
+
+def update_documents(ids):
+    """
+    This method index the documents that exist in the database and
+    remove the others of the index
+    """
+    topics = Topic.objects.filter(
+        pk__in=[id // 2 for id in ids if id % 2 == 0]
+    )
+    comments = Comment.objects.filter(
+        pk__in=[id // 2 for id in ids if id % 2]
+    )
+    documents = [get_document(instance) for instance in chain(
+        topics.only('idtopic', 'title', 'description'),
+        comments.only('idcomment', 'topic', 'description')
+    )]
+    found = set(document[0] for document in documents)
+
+    backend = get_backend()
+    with transaction.atomic():
+        backend.remove([id for id in ids if id not in found])
+        backend.index(documents)
+
+
+def process_queue(size=None):
+    """
+    This method update the documents of the queue, until size. Return the
+    total of documents updated, or None if the queue is empty
+    """
+    r = get_redis_connection()
+    ids = r.spop(SEARCH_QUEUE, size or localSettings.SEARCH_BATCH_SIZE)
+    if not ids:
+        return None
+
+    update_documents([int(id) for id in ids])
+    return len(ids)
+
+
+def search_topics(query, idforum):
+    """
+    This method return the ids of the topics of the forum that match with
+    the query, the most relevant first
+    """
+    return get_backend().search(query, idforum, localSettings.SEARCH_LIMIT)
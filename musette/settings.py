@@ -2,9 +2,63 @@ from django.conf import settings
 
 SITE_NAME = getattr(settings, "SITE_NAME", "Musette")
 
+# Connection to redis for the realtime, hits and notifications
+REDIS_URL = getattr(settings, "MUSETTE_REDIS_URL", "redis://localhost:6379/0")
+
 # Number of seconds of inactivity before a user is marked offline
 USER_ONLINE_TIMEOUT = 300
 
 # Number of seconds that we will keep track of inactive users for before
 # their last seen is removed from the cache
 USER_LASTSEEN_TIMEOUT = 60 * 60 * 24 * 7
+
+# Number of seconds that the url of the photo profile is kept in the cache
+PHOTO_PROFILE_TIMEOUT = 60 * 60 * 24
+
+# Number of notifications displayed in the header
+NOTIFICATIONS_LIMIT = getattr(settings, "MUSETTE_NOTIFICATIONS_LIMIT", 5)
+
+# Number of seconds that the counter of notifications not viewed is kept
+# in redis, after it is recounted from the database
+NOTIFICATIONS_UNREAD_TIMEOUT = 60 * 60 * 24
+
+# Create the notifications in background with the command
+# musette_notifications, else they are created in the request
+NOTIFICATIONS_ASYNC = getattr(settings, "MUSETTE_NOTIFICATIONS_ASYNC", False)
+
+# Number of notifications inserted in each query
+NOTIFICATIONS_BATCH_SIZE = 500
+
+# Number of events kept in the stream of each user and topic, for send
+# them to the clients that reconnect
+REALTIME_STREAM_LENGTH = getattr(
+    settings, "MUSETTE_REALTIME_STREAM_LENGTH", 100
+)
+
+# Number of seconds that the stream of one user or topic is kept
+# after its last event
+REALTIME_STREAM_TIMEOUT = 60 * 60 * 24
+
+# Path of the backend of search, by default the backend of the database
+# (SQLite FTS5, PostgreSQL or without index for the others)
+SEARCH_BACKEND = getattr(settings, "MUSETTE_SEARCH_BACKEND", None)
+
+# Configuration of the text search of PostgreSQL (language)
+SEARCH_CONFIG = getattr(settings, "MUSETTE_SEARCH_CONFIG", "simple")
+
+# Maximum of topics of the results of search
+SEARCH_LIMIT = 200
+
+# Number of topics suggested in each topic
+SUGGESTIONS_LIMIT = 10
+
+# Number of seconds that the suggestions of one topic are kept in the
+# cache, after they are computed again with the new topics
+SUGGESTIONS_TIMEOUT = 60 * 60 * 24
+
+# Index the topics and comments in background with the command
+# musette_index_queue, else they are indexed in the request
+SEARCH_ASYNC = getattr(settings, "MUSETTE_SEARCH_ASYNC", False)
+
+# Number of documents indexed in each batch
+SEARCH_BATCH_SIZE = 500
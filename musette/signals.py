@@ -1,10 +1,13 @@
-from django.db.models.signals import m2m_changed, pre_delete, post_save
+from django.db.models.signals import (
+    m2m_changed, pre_delete, post_delete, post_migrate, post_save
+)
 from django.conf import settings
+from django.db import transaction
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.dispatch import receiver
 
-from musette import models, utils
+from musette import models, notifications, search, suggestions, utils
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -36,6 +39,28 @@ def post_save_user(sender, instance, **kwargs):
             )
 
 
+def post_change_profile(sender, instance, **kwargs):
+    """
+    This signal is event of model profile for clear the photo of the cache
+    """
+    utils.clear_photo_profile(instance.iduser_id)
+
+
+# Only the models profile defined by the user, not each model saved
+for Profile in models.AbstractProfile.__subclasses__():
+    post_save.connect(post_change_profile, sender=Profile)
+    post_delete.connect(post_change_profile, sender=Profile)
+
+
+@receiver(post_save, sender=models.Configuration)
+@receiver(post_delete, sender=models.Configuration)
+def post_change_configuration(sender, instance, **kwargs):
+    """
+    This signal is event of model configuration for clear the cache
+    """
+    utils.clear_configuration(instance.site_id)
+
+
 @receiver(m2m_changed, sender=models.Forum.moderators.through)
 def post_save_forum(sender, instance, **kwargs):
     """
@@ -68,6 +93,85 @@ def pre_delete_receiver_notification(sender, instance, **kwargs):
     Delete notification comment or topic
     """
     ctype = ContentType.objects.get_for_model(instance)
-    models.Notification.objects.filter(
+    notif = models.Notification.objects.filter(
         content_type=ctype, idobject=instance.pk
-    ).delete()
+    )
+
+    # Users that lose one notification not viewed, for recount
+    idusers = set(notif.filter(is_view=False).values_list('iduser', flat=True))
+    notif.delete()
+    notifications.clear_unread_notifications(idusers)
+
+
+@receiver(post_delete, sender=models.Topic)
+def post_delete_topic(sender, instance, **kwargs):
+    """
+    Subtract the topic of the counter of the forum
+    """
+    instance.update_forum_topics(instance.forum_id, "subtraction")
+
+
+@receiver(post_save, sender=models.Comment)
+def post_save_comment(sender, instance, **kwargs):
+    """
+    Add the new comment to the counters of the topic
+    """
+    if kwargs['created']:
+        models.Topic.update_comment_counters(instance, "sum")
+
+
+@receiver(post_delete, sender=models.Comment)
+def post_delete_comment(sender, instance, **kwargs):
+    """
+    Remove the comment of the counters of the topic, if the topic
+    not is deleted too
+    """
+    if not getattr(instance, '_topic_deleted', False):
+        models.Topic.update_comment_counters(instance, "subtraction")
+
+
+@receiver(post_save, sender=models.Topic)
+@receiver(post_save, sender=models.Comment)
+def post_save_search(sender, instance, **kwargs):
+    """
+    Add the topic or comment to the index of search
+    """
+    search.index([instance])
+
+
+@receiver(post_delete, sender=models.Topic)
+@receiver(post_delete, sender=models.Comment)
+def post_delete_search(sender, instance, **kwargs):
+    """
+    Remove the topic or comment of the index of search
+    """
+    search.remove([instance])
+
+
+@receiver(post_migrate)
+def post_migrate_search(sender, **kwargs):
+    """
+    Create the index of search
+    """
+    if sender.name == 'musette':
+        search.get_backend().setup()
+
+
+@receiver(post_save, sender=models.Topic)
+def post_save_suggestions(sender, instance, **kwargs):
+    """
+    Update the topic in the index of suggested topics
+    """
+    idtopic, title = instance.idtopic, instance.title
+    transaction.on_commit(
+        lambda: suggestions.update_topic(idtopic, title)
+    )
+
+
+@receiver(post_delete, sender=models.Topic)
+def post_delete_suggestions(sender, instance, **kwargs):
+    """
+    Remove the topic of the index of suggested topics
+    """
+    idtopic = instance.idtopic
+    transaction.on_commit(lambda: suggestions.remove_topic(idtopic))
@@ -4,15 +4,20 @@
     try{
         var params = JSON.parse($('#musette_module_js').html());
         var user_auth = params.user_auth;
+        var forum = params.forum;
+        var stream_id = params.stream_id;
     }catch(e) {
         var user_auth = null;
+        var forum = null;
+        var stream_id = null;
     }
     
     //Base musette Methods
     var MusetteApp = Vue.extend({
         methods: {
-            //Connection to websockets
-            connectionWs: function (is_user, id) {
+            //Connection to websockets, reconnect when is closed and
+            //receive the messages lost meanwhile
+            connectionWs: function (is_user, id, onmessage) {
                 var protocol;
                 if (window.location.protocol === "https:") {
                     protocol = "wss:";
@@ -22,10 +27,54 @@
 
                 if(is_user) {
                     var url = protocol + "//" + window.location.hostname + ":8888/ws/?user=" + user_auth;
+                    //Forum for the users online in it
+                    if (forum) {
+                        url += "&forum=" + forum;
+                    }
                 } else {
                     var url = protocol + "//" + window.location.hostname + ":8888/ws/?topic=" + id;
                 }
-                return new WebSocket(url);
+
+                //The events since the page was rendered are sent at connect,
+                //the id is of the clock of redis
+                var last_id = stream_id;
+                var delay = 1000;
+                //If the id "milliseconds-sequence" is after the last
+                var isAfter = function (id) {
+                    if (!last_id) {
+                        return true;
+                    }
+                    var a = id.split("-"), b = last_id.split("-");
+                    return Number(a[0]) > Number(b[0]) ||
+                        (Number(a[0]) === Number(b[0]) && Number(a[1]) > Number(b[1]));
+                };
+                var connect = function () {
+                    var ws_url = url;
+                    if (last_id) {
+                        ws_url += "&last_id=" + last_id;
+                    }
+                    var ws = new WebSocket(ws_url);
+                    ws.onopen = function () {
+                        delay = 1000;
+                    };
+                    ws.onmessage = function (evt) {
+                        var obj = JSON.parse(evt.data);
+                        //Remember the last message received
+                        var items = Array.isArray(obj) ? obj : [obj];
+                        for (var i = 0; i < items.length; i++) {
+                            if (items[i].stream_id && isAfter(items[i].stream_id)) {
+                                last_id = items[i].stream_id;
+                            }
+                        }
+                        onmessage(obj);
+                    };
+                    ws.onclose = function () {
+                        //Wait more time in each attempt, max 30 seconds
+                        setTimeout(connect, delay);
+                        delay = Math.min(delay * 2, 30000);
+                    };
+                };
+                connect();
             },
             //Execute the loading ajax.gif
             loading: function() {
@@ -138,17 +187,24 @@
             var idtopic = parseInt($("#topic_musette").val());
             if (!isNaN(idtopic)) {
                 //Connection to websockets
-                var ws = this.connectionWs(false, idtopic);
-                ws.onmessage = function (evt) {
+                this.connectionWs(false, idtopic, function (obj) {
                     //Only add message when scroll end
                     var length = $("a.endless_more").length;
                     if (length == 0) {
-                        var json = evt.data;
-                        var obj = JSON.parse(json);
-                        //Add new comment to model
-                        $that.comments_socket.push(obj);
+                        if (obj.coalesced) {
+                            //The server not sent the comments, are too many
+                            toastr.info(obj.coalesced + " new comments");
+                        } else if (Array.isArray(obj)) {
+                            //Comments sent together by the server
+                            for (var i = 0; i < obj.length; i++) {
+                                $that.comments_socket.push(obj[i]);
+                            }
+                        } else {
+                            //Add new comment to model
+                            $that.comments_socket.push(obj);
+                        }
                     }
-                };    
+                });
             }
         },
         methods: {
@@ -236,15 +292,15 @@
             var $that = this;
 
             //Socket for notifications
-            var ws = this.connectionWs(true);
-            ws.onmessage = function (evt) {
-                //Get object json message
-                var json = evt.data;
-                var obj = JSON.parse(json);
-
-                //Add new notification to model
-                $that.notifications_socket.unshift(obj);
-                $that.tot_notifications++;
+            this.connectionWs(true, null, function (obj) {
+                if (obj.coalesced) {
+                    //The server not sent the notifications, are too many
+                    $that.tot_notifications += obj.coalesced;
+                } else {
+                    //Add new notification to model
+                    $that.notifications_socket.unshift(obj);
+                    $that.tot_notifications++;
+                }
 
                 //Remove class hide
                 $("#badge_notifications").text("0").removeClass("hide").html($that.tot_notifications);
@@ -253,7 +309,7 @@
                 try {
                     $("#no_notifications").addClass("hide");
                 }catch(e){}
-            };
+            });
         },
         methods: {
             //Set in true all notifications
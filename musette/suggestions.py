@@ -0,0 +1,234 @@
+import math
+import re
+import uuid
+from itertools import chain
+
+import redis
+from django.core.cache import cache
+
+from musette import settings as localSettings
+from musette.models import Topic
+from musette.utils import get_redis_connection
+
+# Set of topics with each term of the title
+SUGGEST_TERM = 'musette:suggest:term:%s'
+# Hash idtopic -> terms of the title
+SUGGEST_TERMS = 'musette:suggest:terms'
+
+# Topics compared by their norm, of the topics with more terms in common
+CANDIDATES = 50
+
+WORDS = re.compile(r'\w+', re.UNICODE)
+
+# Words too common for relate the topics
+STOP_WORDS = set("""
+a about an and are as at be by can do for from how i in is it my no not
+of on or so that the this to was what when where which who why with you
+al como con de del el en es la las lo los mas no o para pero por que se
+sin su un una y
+""".split())
+
+
+def get_terms(title):
+    """
+    This method return the terms of one title, without stop words
+    """
+    return sorted(set(
+        word for word in WORDS.findall(title.lower())
+        if len(word) > 1 and word not in STOP_WORDS
+    ))
+
+
+def get_cache_key(idtopic):
+    return 'suggest_%s' % idtopic
+
+
+def get_idf(total, count):
+    """
+    This method return the inverse frequency of one term. It is positive
+    also for the terms of all the topics, for relate the first topics
+    """
+    return math.log(1 + float(total) / count) if count else 0
+
+
+def compute_suggestions(idtopic, terms, r):
+    """
+    This method return the list [idtopic, score] of the topics most
+    similar to the terms, by the cosine of their vectors tf-idf
+    """
+    if not terms:
+        return []
+
+    # Number of topics and of topics with each term
+    pipe = r.pipeline(transaction=False)
+    pipe.hlen(SUGGEST_TERMS)
+    for term in terms:
+        pipe.scard(SUGGEST_TERM % term)
+    replies = pipe.execute()
+    total = replies[0]
+    idf = dict(
+        (term, get_idf(total, count))
+        for term, count in zip(terms, replies[1:])
+    )
+
+    # Sum of the weights of the terms in common with each topic
+    weights = dict(
+        (SUGGEST_TERM % term, idf[term] ** 2) for term in terms if idf[term]
+    )
+    if not weights:
+        return []
+    key = 'musette:suggest:tmp:%s' % uuid.uuid4().hex
+    pipe = r.pipeline()
+    pipe.zunionstore(key, weights)
+    pipe.zrevrange(key, 0, CANDIDATES, withscores=True)
+    pipe.delete(key)
+    candidates = [
+        (int(candidate), score) for candidate, score in pipe.execute()[1]
+        if int(candidate) != idtopic
+    ]
+    if not candidates:
+        return []
+
+    # Norm of the vectors of the candidates
+    terms_candidates = [
+        (value or b'').decode('utf-8').split()
+        for value in r.hmget(SUGGEST_TERMS, [c for c, s in candidates])
+    ]
+    others = sorted(set(
+        term for ts in terms_candidates for term in ts if term not in idf
+    ))
+    pipe = r.pipeline(transaction=False)
+    for term in others:
+        pipe.scard(SUGGEST_TERM % term)
+    for term, count in zip(others, pipe.execute()):
+        idf[term] = get_idf(total, count)
+
+    def norm(ts):
+        return math.sqrt(sum(idf[term] ** 2 for term in ts))
+
+    norm_topic = norm(terms)
+    suggestions = []
+    for (candidate, score), ts in zip(candidates, terms_candidates):
+        if ts:
+            suggestions.append(
+                [candidate, round(score / (norm_topic * norm(ts)), 6)]
+            )
+
+    suggestions.sort(key=lambda s: s[1], reverse=True)
+    return suggestions[:localSettings.SUGGESTIONS_LIMIT]
+
+
+def get_suggestions(topic):
+    """
+    This method return the ids of the topics suggested for one topic,
+    of the cache or computed the first time
+    """
+    suggestions = cache.get(get_cache_key(topic.idtopic))
+    if suggestions is None:
+        try:
+            r = get_redis_connection()
+            suggestions = compute_suggestions(
+                topic.idtopic, get_terms(topic.title), r
+            )
+        except redis.ConnectionError:
+            return []
+        cache.set(
+            get_cache_key(topic.idtopic), suggestions,
+            localSettings.SUGGESTIONS_TIMEOUT
+        )
+    return [idtopic for idtopic, score in suggestions]
+
+
+def update_topic(idtopic, title):
+    """
+    This method add or update one topic in the index and compute its
+    suggestions. The suggestions of the similar topics are computed
+    again when they are displayed
+    """
+    terms = get_terms(title)
+    try:
+        r = get_redis_connection()
+        old = r.hget(SUGGEST_TERMS, idtopic)
+        old = old.decode('utf-8').split() if old is not None else None
+        if old == terms:
+            return
+
+        pipe = r.pipeline()
+        for term in old or []:
+            pipe.srem(SUGGEST_TERM % term, idtopic)
+        for term in terms:
+            pipe.sadd(SUGGEST_TERM % term, idtopic)
+        if terms:
+            pipe.hset(SUGGEST_TERMS, idtopic, ' '.join(terms))
+        else:
+            pipe.hdel(SUGGEST_TERMS, idtopic)
+        pipe.execute()
+
+        suggestions = compute_suggestions(idtopic, terms, r)
+    except redis.ConnectionError:
+        return
+
+    # The frequencies of the terms changed, the similar topics and the
+    # topics similar to the old title are computed again
+    previous = cache.get(get_cache_key(idtopic)) or []
+    cache.delete_many([
+        get_cache_key(s[0]) for s in chain(suggestions, previous)
+    ])
+    cache.set(
+        get_cache_key(idtopic), suggestions, localSettings.SUGGESTIONS_TIMEOUT
+    )
+
+
+def remove_topic(idtopic):
+    """
+    This method remove one topic of the index. The suggestions of
+    the similar topics are computed again
+    """
+    try:
+        r = get_redis_connection()
+        old = r.hget(SUGGEST_TERMS, idtopic)
+        if old is not None:
+            pipe = r.pipeline()
+            for term in old.decode('utf-8').split():
+                pipe.srem(SUGGEST_TERM % term, idtopic)
+            pipe.hdel(SUGGEST_TERMS, idtopic)
+            pipe.execute()
+    except redis.ConnectionError:
+        pass
+
+    previous = cache.get(get_cache_key(idtopic)) or []
+    cache.delete_many(
+        [get_cache_key(idtopic)] + [get_cache_key(s[0]) for s in previous]
+    )
+
+
+def rebuild():
+    """
+    This method index again the titles of all the topics. The
+    suggestions are computed when each topic is displayed
+    """
+    r = get_redis_connection()
+    old = list(r.scan_iter('musette:suggest:*'))
+    if old:
+        r.delete(*old)
+
+    total = 0
+    topics = Topic.objects.order_by().values_list('idtopic', 'title')
+    pipe = r.pipeline(transaction=False)
+    keys = []
+    for idtopic, title in topics.iterator():
+        terms = get_terms(title)
+        for term in terms:
+            pipe.sadd(SUGGEST_TERM % term, idtopic)
+        if terms:
+            pipe.hset(SUGGEST_TERMS, idtopic, ' '.join(terms))
+        keys.append(get_cache_key(idtopic))
+
+        total += 1
+        if len(keys) == 500:
+            pipe.execute()
+            cache.delete_many(keys)
+            keys = []
+    pipe.execute()
+    cache.delete_many(keys)
+    return total
@@ -1,14 +1,13 @@
 from django import template
-from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth import get_user_model
 from django.utils import formats, timezone
 
-from hitcount.models import HitCount
-
-from ..models import Comment, Forum, Topic, Notification
-from .photo import get_photo
-from ..utils import (
-    get_photo_profile, get_datetime_topic
-)
+from ..hits import get_hits
+from ..models import Comment, Forum, Topic, TopicParticipant
+from ..notifications import get_unread_notifications, load_snapshots
+from ..presence import get_last_seen, is_online
+from ..presence import get_online_forum as get_online_forum_users
+from ..utils import get_photos_profile, get_datetime_topic
 
 register = template.Library()
 
@@ -41,19 +40,15 @@ def get_tot_views(idtopic):
     This tag filter return the total
     views for topic or forum
     """
-    try:
-        content = Topic.objects.get(idtopic=idtopic)
-        idobj = ContentType.objects.get_for_model(content)
+    return get_hits(Topic, [int(idtopic)])[int(idtopic)]
 
-        hit = HitCount.objects.get(
-            object_pk=idtopic,
-            content_type_id=idobj
-        )
-        total = hit.hits
-    except Exception:
-        total = 0
 
-    return total
+@register.simple_tag
+def get_tot_views_topics(topics):
+    """
+    This tag return the total views of a list of topics
+    """
+    return get_hits(Topic, [topic.idtopic for topic in topics])
 
 
 @register.filter
@@ -74,29 +69,23 @@ def get_tot_users_comments(topic):
     users of one topic
     """
     idtopic = topic.idtopic
-    users = Comment.objects.filter(topic_id=idtopic)
-
-    data = ""
-    lista = []
-    for user in users:
-        usuario = user.user.username
-        if not (usuario in lista):
-            lista.append(usuario)
+    users = TopicParticipant.objects.filter(topic_id=idtopic).order_by(
+        'user_id'
+    ).values_list('user_id', 'user__username')
 
-            photo = get_photo(user.user.id)
+    if len(users) == 0:
+        users = [(topic.user.id, topic.user.username)]
 
-            tooltip = "data-toggle='tooltip' data-placement='bottom' "
-            tooltip += "title='" + usuario + "'"
-            data += "<a href='/profile/" + usuario + "' " + tooltip + ">"
-            data += "<img class='img-circle' src='" + str(photo) + "' "
-            data += "width=30, height=30></a>"
+    # Get photos of all users with one query
+    photos = get_photos_profile([iduser for iduser, usuario in users])
 
-    if len(users) == 0:
-        usuario = topic.user.username
-        iduser = topic.user.id
+    data = ""
+    for iduser, usuario in users:
+        photo = photos[iduser]
 
-        photo = get_photo(iduser)
-        data += "<a href='/profile/" + usuario + "'>"
+        tooltip = "data-toggle='tooltip' data-placement='bottom' "
+        tooltip += "title='" + usuario + "'"
+        data += "<a href='/profile/" + usuario + "' " + tooltip + ">"
         data += "<img class='img-circle' src='" + str(photo) + "' "
         data += "width=30, height=30></a>"
 
@@ -124,60 +113,57 @@ def get_item_notification(notification):
     This filter return info about
     one notification of one user
     """
-    idobject = notification.idobject
-    is_comment = notification.is_comment
-
-    html = ""
-    try:
-        # If is comment notification
-        if is_comment:
-            comment = Comment.objects.get(idcomment=idobject)
-            forum = comment.topic.forum.name
-            slug = comment.topic.slug
-            idtopic = comment.topic.idtopic
-            username = comment.user.username
-            title = comment.topic.title
-            userid = comment.user.id
-        else:
-            # Is topic notification
-            topic = Topic.objects.get(idtopic=idobject)
-            forum = topic.forum.name
-            slug = topic.slug
-            idtopic = topic.idtopic
-            username = topic.user.username
-            title = topic.title
-            userid = topic.user.id
-
-        url_topic = "/topic/" + forum + "/" + slug + "/" + str(idtopic) + "/"
-        title = "<h5><a href='" + url_topic + "'><u>" + title + "</u></a></h5>"
-
-        # Data profile
-        photo = get_photo_profile(userid)
-        date = get_datetime_topic(notification.date)
-        url_profile = "/profile/" + username
-
-        # Notificacion
-        html += '<a class="content" href="' + url_topic + '">'
-        html += ' <h4 class="item-title">'
-        html += ' <img class="img-circle pull-left" src="' + photo + '"'
-        html += ' width=45 height=45 />'
-        html += title + '</h4>'
-        html += ' <p class="item-info"><a href="' + url_profile + '">'
-        html += username + "</a> - " + str(date)
-        html += '</p></a>'
-    except Comment.DoesNotExist:
-        html = ""
+    # Notifications without snapshot
+    if not notification.payload:
+        load_snapshots([notification])
+
+    snapshot = notification.get_snapshot()
+    if snapshot is None:
+        return ""
+
+    forum = snapshot['forum']
+    slug = snapshot['slug']
+    idtopic = snapshot['idtopic']
+    username = snapshot['username']
+    title = snapshot['topic']
+
+    url_topic = "/topic/" + forum + "/" + slug + "/" + str(idtopic) + "/"
+    title = "<h5><a href='" + url_topic + "'><u>" + title + "</u></a></h5>"
+
+    # Data profile
+    photo = snapshot['photo']
+    date = get_datetime_topic(notification.date)
+    url_profile = "/profile/" + username
+
+    # Notificacion
+    html = '<a class="content" href="' + url_topic + '">'
+    html += ' <h4 class="item-title">'
+    html += ' <img class="img-circle pull-left" src="' + photo + '"'
+    html += ' width=45 height=45 />'
+    html += title + '</h4>'
+    html += ' <p class="item-info"><a href="' + url_profile + '">'
+    html += username + "</a> - " + str(date)
+    html += '</p></a>'
 
     return html
 
 
+@register.simple_tag
+def load_notifications(notifications):
+    """
+    This tag load the data of the notifications
+    without snapshot in one query
+    """
+    load_snapshots(notifications)
+    return ""
+
+
 @register.filter
 def get_pending_notifications(user):
     """
     This method return total pending notifications
     """
-    return Notification.objects.filter(
-        is_view=False, iduser=user).count()
+    return get_unread_notifications(user)
 
 
 @register.filter
@@ -216,3 +202,41 @@ def get_tot_users_forum(forum):
     users_registers = forum.register_forums.all().count()
     moderators = forum.moderators.all().count()
     return users_registers + moderators
+
+
+@register.filter
+def get_item(dictionary, key):
+    """
+    Get the value of one key of a dict
+    """
+    return dictionary.get(key)
+
+
+@register.simple_tag
+def get_presence(objects):
+    """
+    This tag return the last time seen of the users of a list of
+    objects, like comments or registers, in one call to redis
+    """
+    return get_last_seen(
+        getattr(obj, 'user_id', None) or obj.pk for obj in objects
+    )
+
+
+@register.filter
+def is_user_online(last_seen):
+    """
+    This filter return True if the user was seen recently
+    """
+    return is_online(last_seen)
+
+
+@register.simple_tag
+def get_online_forum(forum):
+    """
+    This tag return the users online in one forum
+    """
+    User = get_user_model()
+    return User.objects.filter(
+        id__in=get_online_forum_users(forum.idforum)
+    ).order_by('username')
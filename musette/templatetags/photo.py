@@ -1,7 +1,7 @@
 # encoding:utf-8
 from django import template
 
-from ..utils import get_photo_profile
+from ..utils import get_photo_profile, get_photos_profile
 
 register = template.Library()
 
@@ -11,5 +11,14 @@ def get_photo(user):
     """
     This tag return the path photo profile
     """
-    field_photo = get_photo_profile(user)
+    field_photo = get_photo_profile(getattr(user, 'pk', user))
     return field_photo
+
+
+@register.simple_tag
+def get_photos(objects):
+    """
+    This tag return the photos profile of the users
+    of a list of objects, like comments or topics
+    """
+    return get_photos_profile([obj.user_id for obj in objects])
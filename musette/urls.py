@@ -10,12 +10,17 @@ from musette.api.urls import router
 
 admin.site.site_header = settings.SITE_NAME
 
+# The hits are counted in redis
+hitcount_urls = [
+    url(r'^hit/ajax/$', views.HitCountView.as_view(), name='hit_ajax'),
+]
+
 urlpatterns = [
     # Url for django-rest-framework
     url(r'^', include(router.urls)),
     url(r'^api/', include('rest_framework.urls', namespace='rest_framework')),
     # Url for django-hitcount
-    url(r'hitcount/', include('hitcount.urls', namespace='hitcount')),
+    url(r'hitcount/', include(hitcount_urls, namespace='hitcount')),
 
     # Url's Django-musette
     url(r'^login/', views.LoginView.as_view(), name='login'),
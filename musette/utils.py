@@ -2,19 +2,23 @@ import base64
 import hashlib
 import os
 import random
+import redis
 import shutil
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Count
 from django.contrib.staticfiles.templatetags.staticfiles import static
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from musette.models import (
-    Forum, Topic, Comment, Register,
-    Notification, AbstractProfile
+    Category, Configuration, Forum, Topic, Register,
+    Notification, AbstractProfile, TopicParticipant
 )
+from musette import settings as localSettings
 from musette.email import send_mail
 
 
@@ -68,17 +72,10 @@ def get_folder_attachment(topic):
 def remove_folder_attachment(idtopic):
     """
     This method remove folder attachment
-    and subtract one topic.
-    """
-    # Subtract one topic
-    topic = get_object_or_404(Topic, idtopic=idtopic)
-    forum = get_object_or_404(Forum, name=topic.forum, hidden=False)
-    tot = forum.topics_count
-    tot = tot - 1
-    Forum.objects.filter(name=topic.forum, hidden=False).update(
-        topics_count=tot
+    """
+    topic = get_object_or_404(
+        Topic.objects.select_related('user'), idtopic=idtopic
     )
-
     path = get_folder_attachment(topic)
 
     # Remove attachment if exists
@@ -86,6 +83,17 @@ def remove_folder_attachment(idtopic):
         remove_folder(path)
 
 
+# Pool of connections to redis shared by all the requests
+REDIS_POOL = redis.ConnectionPool.from_url(localSettings.REDIS_URL)
+
+
+def get_redis_connection():
+    """
+    This method return one connection to redis of the pool
+    """
+    return redis.StrictRedis(connection_pool=REDIS_POOL)
+
+
 def get_main_model_profile():
     """
     This method return the model profile defined by user
@@ -128,14 +136,55 @@ def get_users_topic(topic, myuser):
     """
     This method return all users of one topic, else my user
     """
-    comments = Comment.objects.filter(topic_id=topic.idtopic)
-    lista_us = []
-    for comment in comments:
-        if comment.user_id != myuser:
-            if not (comment.user_id in lista_us):
-                lista_us.append(comment.user_id)
+    return list(TopicParticipant.objects.filter(
+        topic_id=topic.idtopic
+    ).exclude(user_id=myuser).values_list('user_id', flat=True))
+
+
+def get_forums_index():
+    """
+    This method return the categories visibles with their forums and
+    subforums, in a constant number of queries
+    """
+    categories = list(Category.objects.filter(hidden=False))
+    forums = Forum.objects.filter(hidden=False, category__hidden=False)
+
+    # Get counters of all forums grouped by forum
+    registers = dict(
+        Register.objects.order_by().values('forum_id').annotate(
+            tot=Count('idregister')
+        ).values_list('forum_id', 'tot')
+    )
+    pending = dict(
+        Topic.objects.filter(moderate=False).order_by().values(
+            'forum_id'
+        ).annotate(tot=Count('idtopic')).values_list('forum_id', 'tot')
+    )
+    moderators = {}
+    for idforum, iduser in Forum.moderators.through.objects.values_list(
+            'forum_id', 'user_id'):
+        moderators.setdefault(idforum, []).append(iduser)
+
+    # Build tree categories -> forums -> subforums
+    tree = dict((category.idcategory, []) for category in categories)
+    childs = {}
+    for forum in forums:
+        forum.moderators_ids = moderators.get(forum.idforum, [])
+        forum.tot_users = (
+            registers.get(forum.idforum, 0) + len(forum.moderators_ids)
+        )
+        forum.tot_pending_moderate = pending.get(forum.idforum, 0)
+        forum.childs = childs.setdefault(forum.idforum, [])
+
+        if forum.parent_id:
+            childs.setdefault(forum.parent_id, []).append(forum)
+        elif forum.category_id in tree:
+            tree[forum.category_id].append(forum)
 
-    return lista_us
+    for category in categories:
+        category.forums = tree[category.idcategory]
+
+    return categories
 
 
 def get_notifications(iduser):
@@ -233,18 +282,71 @@ def get_photo_profile(iduser):
     """
     This method return photo profile
     """
+    return get_photos_profile([iduser])[iduser]
+
+
+def get_photos_profile(idusers):
+    """
+    This method return a dict iduser -> photo profile of many users.
+    The photos are got of the cache, and the users that not are in
+    the cache are resolved with one query
+    """
     default_photo = static("musette/img/profile.png")
-    ModelProfile = get_main_model_profile()
-    profile = ModelProfile.objects.filter(iduser=iduser)
-    if profile.count() > 0:
-        photo = profile[0].photo
-        if photo:
-            field_photo = settings.MEDIA_URL + str(photo)
-        else:
-            field_photo = default_photo
-    else:
-        field_photo = default_photo
-    return field_photo
+    keys = dict(('photo_%s' % iduser, iduser) for iduser in set(idusers))
+    photos = dict(
+        (keys[key], photo) for key, photo in cache.get_many(keys).items()
+    )
+
+    # Users that not are in the cache
+    missing = [iduser for iduser in keys.values() if iduser not in photos]
+    if missing:
+        ModelProfile = get_main_model_profile()
+        profiles = ModelProfile.objects.filter(
+            iduser__in=missing
+        ).values_list('iduser', 'photo')
+
+        for iduser in missing:
+            photos[iduser] = default_photo
+        for iduser, photo in profiles:
+            if photo:
+                photos[iduser] = settings.MEDIA_URL + str(photo)
+
+        cache.set_many(
+            dict(('photo_%s' % iduser, photos[iduser]) for iduser in missing),
+            localSettings.PHOTO_PROFILE_TIMEOUT
+        )
+
+    return photos
+
+
+def clear_photo_profile(iduser):
+    """
+    This method remove of the cache the photo profile of one user
+    """
+    cache.delete('photo_%s' % iduser)
+
+
+def get_configuration(idsite):
+    """
+    This method return the configuration of one site, or None
+    if the site not has configuration
+    """
+    key = 'configuration_%s' % idsite
+    configuration = cache.get(key)
+
+    if configuration is None:
+        configuration = Configuration.objects.filter(site_id=idsite).first()
+        # False if not exists, for not query again
+        cache.set(key, configuration or False, None)
+
+    return configuration or None
+
+
+def clear_configuration(idsite):
+    """
+    This method remove of the cache the configuration of one site
+    """
+    cache.delete('configuration_%s' % idsite)
 
 
 def send_welcome_email(email, username, activation_key):
@@ -1,9 +1,8 @@
 import base64
-import json
 import redis
 from itertools import chain
 
-from django.db.models import Q
+from django.db.models import Case, IntegerField, Q, When
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model, login, logout
@@ -13,8 +12,10 @@ from django.contrib.auth.views import (
     password_reset, password_reset_complete,
     password_reset_confirm
 )
-from django.contrib.contenttypes.models import ContentType
-from django.http import Http404, HttpResponse, HttpResponseRedirect, QueryDict
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest,
+    HttpResponseRedirect, JsonResponse, QueryDict
+)
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template import defaultfilters
 from django.views.generic import View
@@ -24,7 +25,14 @@ from django.utils import timezone
 from django.utils.html import conditional_escape
 from django.utils.translation import ugettext_lazy as _
 
-from musette import forms, models, utils
+from hitcount.models import HitCount
+from hitcount.utils import get_ip
+from hitcount.views import HitCountJSONView
+
+from musette import (
+    forms, hits, models, notifications, realtime, suggestions, utils
+)
+from musette.search import search_topics
 
 
 class LoginView(FormView):
@@ -248,8 +256,8 @@ class ForumsView(View):
     template_name = "musette/index.html"
 
     def get(self, request, *args, **kwargs):
-        # Get categories that not hidden
-        categories = models.Category.objects.filter(hidden=False)
+        # Get categories that not hidden with their forums
+        categories = utils.get_forums_index()
 
         data = {
             'categories': categories
@@ -271,7 +279,7 @@ class ForumView(View):
         forum = get_object_or_404(models.Forum, name=forum, hidden=False)
         topics = models.Topic.objects.filter(
             forum_id=forum.idforum
-        ).order_by("-is_top", "-last_activity", "-date")
+        ).select_related("user").order_by("-is_top", "-last_activity", "-date")
 
         # Get forum childs
         forums_childs = models.Forum.objects.filter(parent=forum, hidden=False)
@@ -336,19 +344,21 @@ class TopicView(View):
         form_comment = forms.FormAddComment()
 
         # Get comments of the topic
-        comments = models.Comment.objects.filter(topic_id=idtopic)
+        comments = models.Comment.objects.filter(
+            topic_id=idtopic
+        ).select_related("user", "user__user")
 
         # Get photo of created user topic
         photo = utils.get_photo_profile(topic.user.id)
 
-        # Get suggest topic
-        words = topic.title.split(" ")
-        condition = Q()
-        for word in words:
-            condition |= Q(title__icontains=word)
-        suggest = models.Topic.objects.filter(condition).exclude(
-            idtopic=topic.idtopic
-        )[:10]
+        # Get suggest topic, the most similar first
+        idtopics = suggestions.get_suggestions(topic)
+        suggest = sorted(
+            models.Topic.objects.filter(
+                idtopic__in=idtopics
+            ).select_related("forum", "user"),
+            key=lambda t: idtopics.index(t.idtopic)
+        )
 
         data = {
             'topic': topic,
@@ -439,44 +449,34 @@ class NewTopicView(FormView):
             # Save topic
             obj.save()
 
-            # Get moderators forum
-            list_us = []
-            for moderator in forum.moderators.all():
-                # If not is my user
-                if moderator.id != request.user.id:
-                    # Send notification to moderator
-                    related_object = ContentType.objects.get_for_model(obj)
-                    notification = models.Notification(
-                        iduser=moderator.id, is_view=False,
-                        idobject=obj.idtopic, date=now,
-                        is_topic=True, is_comment=False,
-                        content_type=related_object
-                    )
-                    notification.save()
-                    list_us.append(moderator.id)
-
             # Get photo profile
             username = request.user.username
             photo = utils.get_photo_profile(request.user.id)
 
+            # Data for display the notification
+            payload = notifications.make_snapshot(obj, request.user, photo)
+
+            # Get moderators forum, if not is my user
+            list_us = [
+                moderator.id for moderator in forum.moderators.all()
+                if moderator.id != request.user.id
+            ]
+
+            # Send notification to moderators
+            notifications.send_notifications(list_us, obj, payload, now)
+
             # Data necessary for realtime
             data = {
                 "topic": obj.title,
                 "idtopic": obj.idtopic,
                 "slug": obj.slug,
-                "settings_static": settings.STATIC_URL,
                 "username": username,
                 "forum": forum.name,
-                "list_us": list_us,
                 "photo": photo
             }
 
             # Add to real time new notification
-            json_data_notification = json.dumps(data)
-            # Redis instance
-            r = redis.StrictRedis()
-            # Publish
-            r.publish('notifications', json_data_notification)
+            realtime.publish(notification=data, idusers=list_us)
 
             messages.success(
                 request, _("The topic '%(topic)s' was successfully created")
@@ -674,7 +674,10 @@ class NewCommentView(View):
             now = timezone.now()
             User = get_user_model()
             user = User.objects.get(id=request.user.id)
-            topic = get_object_or_404(models.Topic, idtopic=idtopic)
+            topic = get_object_or_404(
+                models.Topic.objects.select_related('forum', 'user'),
+                idtopic=idtopic
+            )
             obj.date = now
             obj.user = user
             obj.topic_id = topic.idtopic
@@ -693,6 +696,9 @@ class NewCommentView(View):
             # Get photo profile
             photo = utils.get_photo_profile(request.user.id)
 
+            # Data for display the notification
+            payload = notifications.make_snapshot(topic, user, photo)
+
             # Send notifications
             list_us = utils.get_users_topic(topic, request.user.id)
             lista_email = []
@@ -707,17 +713,8 @@ class NewCommentView(View):
             else:
                 user_original_topic = None
 
-            # Get content type for comment model
-            related_object_type = ContentType.objects.get_for_model(comment)
-            for user in list_us:
-                if user_original_topic != request.user.id:
-                    notification = models.Notification(
-                        iduser=user, is_view=False,
-                        idobject=idcomment, date=now,
-                        is_topic=False, is_comment=True,
-                        content_type=related_object_type
-                    )
-                    notification.save()
+            if user_original_topic != request.user.id:
+                notifications.send_notifications(list_us, obj, payload, now)
 
             # Send email notification
             if settings.SITE_URL.endswith("/"):
@@ -728,33 +725,28 @@ class NewCommentView(View):
             # Send email
             form.send_mail_comment(site, url, lista_email)
 
-            # Data necessary for realtime
-            data = {
+            # Data necessary for realtime, only the fields displayed
+            data_notification = {
                 "topic": comment.topic.title,
                 "idtopic": comment.topic.idtopic,
                 "slug": comment.topic.slug,
-                "settings_static": settings.STATIC_URL,
                 "username": username,
                 "forum": forum,
                 "photo": photo
             }
 
-            # Add item for notification
-            data_notification = data
-            data_notification['list_us'] = list_us
+            # The topic of the comment is the channel
+            data_comment = {
+                "username": username,
+                "photo": photo,
+                "description": comment.description
+            }
 
-            # Add to real time new notification
-            json_data_notification = json.dumps(data_notification)
-            # Redis instance
-            r = redis.StrictRedis()
-            # Publish
-            r.publish('notifications', json_data_notification)
-
-            # Publish new comment in topic
-            data_comment = data
-            data_comment['description'] = comment.description
-            json_data_comment = json.dumps(data_comment)
-            r.publish('comments', json_data_comment)
+            # Publish to real time the notification and the comment
+            realtime.publish(
+                notification=data_notification, idusers=list_us,
+                comment=data_comment, idtopic=topic.idtopic
+            )
 
             messages.success(request, _("Added new comment"))
             return HttpResponseRedirect(url)
@@ -833,11 +825,11 @@ class AllNotification(View):
         models.Notification.objects.filter(iduser=iduser).update(
             is_view=True
         )
+        notifications.reset_unread_notifications(iduser)
 
         # Get all notification user
-        notifications = utils.get_notifications(iduser)
         data = {
-            'notifications': notifications,
+            'notifications': utils.get_notifications(iduser),
         }
 
         if request.is_ajax():
@@ -851,6 +843,7 @@ def SetNotifications(request):
     """
     iduser = request.user.id
     models.Notification.objects.filter(iduser=iduser).update(is_view=True)
+    notifications.reset_unread_notifications(iduser)
 
     return HttpResponse("Ok")
 
@@ -951,10 +944,15 @@ class TopicSearch(View):
         forum = get_object_or_404(models.Forum, name=forum)
         idforum = forum.idforum
 
-        # Search topics
+        # Search topics, the most relevant first
+        idtopics = search_topics(search or '', idforum)
+        order = Case(*[
+            When(idtopic=idtopic, then=position)
+            for position, idtopic in enumerate(idtopics)
+        ], default=len(idtopics), output_field=IntegerField())
         topics = models.Topic.objects.filter(
-            forum_id=idforum, title__icontains=search
-        )
+            idtopic__in=idtopics
+        ).select_related("user").order_by(order)
 
         data = {
             'topics': topics,
@@ -1092,3 +1090,55 @@ class EditProfileView(FormView):
         else:
             messages.error(request, _("Form invalid"))
             return self.form_invalid(form, **kwargs)
+
+
+class HitCountView(HitCountJSONView):
+    """
+    This view count the hits of topics and forums in redis,
+    the hits are saved in the database by musette_flush_hits
+    """
+    def post(self, request, *args, **kwargs):
+        hitcount_pk = request.POST.get('hitcountPK')
+
+        try:
+            hitcount_pk = int(hitcount_pk)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest("HitCount object_pk not working")
+
+        if not HitCount.objects.filter(pk=hitcount_pk).exists():
+            return HttpResponseBadRequest("HitCount object_pk not working")
+
+        # The visitor is the user or the session
+        if request.user.is_authenticated():
+            visitor = "user_" + str(request.user.id)
+        else:
+            if request.session.session_key is None:
+                request.session.save()
+            visitor = "session_" + request.session.session_key
+
+        try:
+            # The filters of django-hitcount: blacklists, groups and IPs
+            hit_message = hits.exclude_hit(request)
+            if hit_message:
+                return JsonResponse({
+                    'hit_counted': False,
+                    'hit_message': hit_message
+                })
+
+            hit_counted = hits.count_hit(
+                hitcount_pk, visitor, get_ip(request)
+            )
+        except redis.ConnectionError:
+            # Without redis, count the hit in the database
+            return super(HitCountView, self).post(request, *args, **kwargs)
+
+        if hit_counted:
+            hit_message = "Hit counted: " + visitor.split("_")[0]
+        else:
+            hit_message = "Not counted: " + visitor.split("_")[0]
+            hit_message += " has active hit"
+
+        return JsonResponse({
+            'hit_counted': hit_counted,
+            'hit_message': hit_message
+        })
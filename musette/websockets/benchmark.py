@@ -0,0 +1,74 @@
+from __future__ import print_function
+
+import json
+import timeit
+
+from musette.websockets import server
+from musette.websockets.channels import USER_CHANNEL
+
+# Connected clients for each measure
+CLIENTS = [100, 1000, 10000, 20000]
+
+# Users that receive each notification
+RECIPIENTS = 10
+
+
+class FakeHandler(object):
+    """
+    Handler that only count the messages sent
+    """
+    def __init__(self, user):
+        self.user = user
+        self.sent = 0
+
+    def send(self, message):
+        self.sent += 1
+
+
+def dispatch_linear(handlers, message):
+    """
+    Delivery of the previous version, scan all the clients and
+    decode the message one time for each client
+    """
+    for handler in handlers:
+        data = json.loads(message.decode("utf-8"))
+        if handler.user in data['list_us']:
+            handler.send(message)
+
+
+def dispatch_indexed(message):
+    """
+    Delivery with the routing tables of the server, the
+    notification is published in the channel of each user
+    """
+    for user in range(RECIPIENTS):
+        server.on_redis_message(USER_CHANNEL % user, message)
+
+
+def run(number=20):
+    message = json.dumps({
+        "topic": "Benchmark", "list_us": list(range(RECIPIENTS))
+    }).encode("utf-8")
+
+    print("clients    linear (ms)    indexed (ms)")
+    for total in CLIENTS:
+        handlers = [FakeHandler(user) for user in range(total)]
+        server.clients_notifications.clear()
+        for handler in handlers:
+            server.add_client(
+                server.clients_notifications, handler.user, handler
+            )
+
+        linear = timeit.timeit(
+            lambda: dispatch_linear(handlers, message), number=number
+        )
+        indexed = timeit.timeit(
+            lambda: dispatch_indexed(message), number=number
+        )
+        print("%7d %14.3f %15.3f" % (
+            total, linear * 1000 / number, indexed * 1000 / number
+        ))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,58 @@
+# Channels of redis with the events of one user and of one topic
+USER_CHANNEL = 'musette:user:%s'
+TOPIC_CHANNEL = 'musette:topic:%s'
+
+PREFIX_USER = USER_CHANNEL % ''
+PREFIX_TOPIC = TOPIC_CHANNEL % ''
+
+# Stream with the last events of each channel, for replay them
+# to the clients that reconnect
+STREAM_KEY = '%s:stream'
+
+# Sorted sets with the last time seen (timestamp) of each user, in all
+# the forum and in one forum. They are updated by the websocket server
+PRESENCE_KEY = 'musette:presence'
+PRESENCE_FORUM_KEY = 'musette:presence:forum:%s'
+
+
+def parse_channel(channel):
+    """
+    This method return the kind ('user' or 'topic')
+    and the id of one channel
+    """
+    if channel.startswith(PREFIX_USER):
+        return 'user', int(channel[len(PREFIX_USER):])
+    elif channel.startswith(PREFIX_TOPIC):
+        return 'topic', int(channel[len(PREFIX_TOPIC):])
+    else:
+        return None, None
+
+
+def parse_stream_id(stream_id):
+    """
+    This method return one id of a stream like a tuple for compare it
+    """
+    if isinstance(stream_id, bytes):
+        stream_id = stream_id.decode('utf-8')
+    milliseconds, sequence = stream_id.split('-')
+    return int(milliseconds), int(sequence)
+
+
+def add_stream_id(stream_id, message):
+    """
+    This method add the field stream_id to one message json
+    """
+    if not isinstance(stream_id, bytes):
+        stream_id = stream_id.encode('utf-8')
+    return b'{"stream_id": "' + stream_id + b'", ' + message[1:]
+
+
+def get_stream_id(message):
+    """
+    This method return the id of stream of one message, or None
+    """
+    prefix = b'{"stream_id": "'
+    if message.startswith(prefix):
+        end = message.index(b'"', len(prefix))
+        return parse_stream_id(message[len(prefix):end])
+    return None
@@ -0,0 +1,29 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Subprotocol of the clients that receive the messages in msgpack
+MSGPACK_PROTOCOL = 'musette.msgpack'
+
+# Last message encoded, it is the same for all the clients of a channel
+last_encoded = [None, None]
+
+
+def is_available():
+    return msgpack is not None
+
+
+def to_msgpack(message):
+    """
+    This method return one message json encoded in msgpack
+    """
+    if last_encoded[0] is not message:
+        if isinstance(message, bytes):
+            data = json.loads(message.decode('utf-8'))
+        else:
+            data = json.loads(message)
+        last_encoded[:] = [message, msgpack.packb(data, use_bin_type=True)]
+    return last_encoded[1]
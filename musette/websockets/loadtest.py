@@ -0,0 +1,282 @@
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import tornado.httpserver
+import tornado.netutil
+from tornado import gen, ioloop, websocket
+
+from musette.websockets import metrics, server
+from musette.websockets.channels import TOPIC_CHANNEL, USER_CHANNEL
+from musette.websockets.subscriber import RedisClient, RedisSubscriber
+
+
+class FakeSubscriber(object):
+    """
+    Subscriber without redis, the messages are sent to the
+    server in the same process
+    """
+    def __init__(self):
+        self.channels = set()
+
+    def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    def publish(self, channel, message):
+        if channel in self.channels:
+            server.on_redis_message(channel, message)
+
+
+class Results(object):
+    """
+    Measures of the clients
+    """
+    def __init__(self):
+        self.connected = 0
+        self.errors = 0
+        self.received = 0
+        self.coalesced = 0
+        self.latencies = []
+        self.last_received = None
+
+
+def percentile(values, percent):
+    """
+    This method return the percentile of the values sorted
+    """
+    if not values:
+        return 0
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+@gen.coroutine
+def connect(url, results):
+    """
+    Open one client, return the connection or None if it fails
+    """
+    try:
+        connection = yield websocket.websocket_connect(url)
+    except Exception:
+        results.errors += 1
+        raise gen.Return(None)
+
+    results.connected += 1
+    raise gen.Return(connection)
+
+
+@gen.coroutine
+def receive(connection, results):
+    """
+    Read the messages of one client until it is closed
+    """
+    while True:
+        message = yield connection.read_message()
+        if message is None:
+            break
+
+        now = time.time()
+        data = json.loads(message)
+        if isinstance(data, dict) and 'coalesced' in data:
+            results.coalesced += data['coalesced']
+            continue
+
+        # The comments of a batch window are sent in one array
+        for item in (data if isinstance(data, list) else [data]):
+            results.received += 1
+            results.latencies.append(now - item['published'])
+        results.last_received = now
+
+
+@gen.coroutine
+def run_clients(port, options, publisher):
+    base = 'ws://127.0.0.1:%d/ws/' % port
+    results = Results()
+
+    # Half of the clients are users and half are in the topics
+    urls = []
+    users, topics = [], {}
+    for i in range(options.clients):
+        if i % 2:
+            idtopic = i % options.topics
+            topics[idtopic] = topics.get(idtopic, 0) + 1
+            urls.append(base + '?topic=%d' % idtopic)
+        else:
+            users.append(i)
+            urls.append(base + '?user=%d' % i)
+
+    start = time.time()
+    connections = []
+    for i in range(0, len(urls), options.concurrency):
+        connections.extend((yield [
+            connect(url, results)
+            for url in urls[i:i + options.concurrency]
+        ]))
+    connect_time = time.time() - start
+    connections = [c for c in connections if c is not None]
+
+    for connection in connections:
+        ioloop.IOLoop.current().spawn_callback(
+            receive, connection, results
+        )
+
+    # Wait the subscriptions of the server
+    yield gen.sleep(options.settle)
+
+    # Publish the events, one for a topic and one for a user
+    expected = 0
+    start = time.time()
+    for i in range(options.messages):
+        if i % 2 and topics:
+            idtopic = list(topics)[(i // 2) % len(topics)]
+            channel = TOPIC_CHANNEL % idtopic
+            expected += topics[idtopic]
+        else:
+            channel = USER_CHANNEL % users[(i // 2) % len(users)]
+            expected += 1
+
+        message = json.dumps({
+            'username': 'loadtest', 'description': 'x' * options.size,
+            'published': time.time()
+        }).encode('utf-8')
+        yield publisher(channel, message)
+
+        wait = start + (i + 1) / float(options.rate) - time.time()
+        if wait > 0:
+            yield gen.sleep(wait)
+    publish_time = time.time() - start
+
+    # Wait the messages pending
+    deadline = time.time() + options.timeout
+    while results.received + results.coalesced < expected and \
+            time.time() < deadline:
+        yield gen.sleep(0.1)
+
+    for connection in connections:
+        connection.close()
+
+    results.expected = expected
+    results.connect_time = connect_time
+    results.publish_time = publish_time
+    results.delivery_time = (results.last_received or time.time()) - start
+    raise gen.Return(results)
+
+
+def report(options, results):
+    latencies = sorted(results.latencies)
+    print('Clients:      %d connected, %d errors' % (
+        results.connected, results.errors
+    ))
+    print('Connections:  %.0f/s (%.2f s)' % (
+        results.connected / max(results.connect_time, 0.001),
+        results.connect_time
+    ))
+    print('Published:    %d messages in %.2f s' % (
+        options.messages, results.publish_time
+    ))
+    print('Delivered:    %d of %d (%d coalesced), %.0f messages/s' % (
+        results.received, results.expected, results.coalesced,
+        results.received / max(results.delivery_time, 0.001)
+    ))
+    print('Latency (ms): p50 %.1f, p99 %.1f, max %.1f' % (
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+        (latencies[-1] if latencies else 0) * 1000
+    ))
+    print('Fan-out:      %s' % json.dumps(metrics.fanout.as_dict()['buckets']))
+
+
+def run(options):
+    """
+    This method run the server and the clients in the same ioloop
+    """
+    io_loop = ioloop.IOLoop.current()
+
+    server.batch_window = options.batch_window
+    application = server.make_application(
+        queue_size=options.queue_size, compression=options.compression
+    )
+    sockets = tornado.netutil.bind_sockets(0, address='127.0.0.1')
+    http_server = tornado.httpserver.HTTPServer(application)
+    http_server.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+
+    if options.redis:
+        host, _, redis_port = options.redis.partition(':')
+        redis_options = {'host': host, 'port': int(redis_port or 6379)}
+        server.subscriber = RedisSubscriber(
+            [], server.on_redis_message, **redis_options
+        )
+        server.redis_client = RedisClient(**redis_options)
+        io_loop.add_callback(server.subscriber.run)
+        publish_client = RedisClient(**redis_options)
+
+        def publisher(channel, message):
+            return publish_client.execute_many([
+                ('PUBLISH', channel, message)
+            ])
+    else:
+        fake = FakeSubscriber()
+        server.subscriber = fake
+
+        @gen.coroutine
+        def publisher(channel, message):
+            fake.publish(channel, message)
+
+    # The server print each connection
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        results = io_loop.run_sync(
+            lambda: run_clients(port, options, publisher)
+        )
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    if options.redis:
+        server.subscriber.stop()
+        io_loop.run_sync(lambda: gen.sleep(0.1))
+    http_server.stop()
+    report(options, results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load test of the websocket server.'
+    )
+    parser.add_argument('--clients', type=int, default=1000,
+                        help='Clients connected, half users and half '
+                             'in the topics.')
+    parser.add_argument('--topics', type=int, default=10,
+                        help='Topics of the clients.')
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='Messages published.')
+    parser.add_argument('--rate', type=int, default=500,
+                        help='Messages published by second.')
+    parser.add_argument('--size', type=int, default=200,
+                        help='Length of the description of the messages.')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='Connections opened at the same time.')
+    parser.add_argument('--redis', default=None,
+                        help='host:port of redis. By default the messages '
+                             'are published without redis.')
+    parser.add_argument('--queue-size', type=int, default=100)
+    parser.add_argument('--batch-window', type=int, default=0)
+    parser.add_argument('--compression', action='store_true', default=False)
+    parser.add_argument('--settle', type=float, default=1,
+                        help='Seconds between the connections and the '
+                             'messages.')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='Seconds to wait the messages pending.')
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
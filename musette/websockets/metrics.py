@@ -0,0 +1,54 @@
+import json
+import time
+
+# Counters of the process
+counters = {'messages_received': 0, 'frames_sent': 0, 'bytes_sent': 0}
+
+
+class Histogram(object):
+    """
+    Histogram with the total of values lower or equal to each bucket
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+
+    def as_dict(self):
+        return {
+            'buckets': dict(
+                (str(bucket), count)
+                for bucket, count in zip(self.buckets, self.counts)
+            ),
+            'count': self.count,
+            'sum': self.sum
+        }
+
+
+# Clients that receive each message of redis
+fanout = Histogram([0, 1, 5, 10, 50, 100, 500, 1000, 5000])
+
+# Seconds since the message was published by django until it is sent
+latency = Histogram([0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+
+
+def observe_latency(message):
+    """
+    This method add the latency of one message with the
+    field published (timestamp) to the histogram
+    """
+    try:
+        published = json.loads(message.decode('utf-8')).get('published')
+    except (ValueError, AttributeError):
+        return
+
+    if published:
+        latency.observe(max(time.time() - published, 0))
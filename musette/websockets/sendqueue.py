@@ -0,0 +1,58 @@
+import json
+from collections import deque
+
+# Policies when the queue of one client is full
+DROP = 'drop'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP, COALESCE, DISCONNECT)
+
+# Counters of the messages not sent to the slow clients of the process
+stats = {'dropped': 0, 'coalesced': 0, 'disconnected': 0}
+
+
+class SendQueue(object):
+    """
+    Queue of the messages pending of send to one client. When is full:
+    drop remove the oldest message, coalesce replace the messages by one
+    message {"coalesced": total} and disconnect close the client
+    """
+    def __init__(self, size=100, policy=DROP):
+        self.size = size
+        self.policy = policy
+        self.messages = deque()
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.messages) + (1 if self.coalesced else 0)
+
+    def push(self, message):
+        """
+        Add one message. Return False if the client must be disconnected
+        """
+        if len(self.messages) < self.size:
+            self.messages.append(message)
+        elif self.policy == DROP:
+            self.messages.popleft()
+            self.messages.append(message)
+            stats['dropped'] += 1
+        elif self.policy == COALESCE:
+            total = len(self.messages) + 1
+            self.messages.clear()
+            self.coalesced += total
+            stats['coalesced'] += total
+        else:
+            stats['disconnected'] += 1
+            return False
+
+        return True
+
+    def pop(self):
+        """
+        Return the next message to send
+        """
+        if self.coalesced:
+            message = json.dumps({'coalesced': self.coalesced})
+            self.coalesced = 0
+            return message
+        return self.messages.popleft()
@@ -1,112 +1,451 @@
 from __future__ import print_function
 
-import json
-import threading
-from functools import partial
+import os
+import time
 
-import redis
+import tornado.gen
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 import tornado.websocket
+from tornado.iostream import StreamClosedError
 
-# Client users listener list
-clients_notifications = []
-clients_comments = []
+from musette.websockets import encoding, metrics, sendqueue
+from musette.websockets.channels import (
+    PRESENCE_FORUM_KEY, PRESENCE_KEY, STREAM_KEY, TOPIC_CHANNEL,
+    USER_CHANNEL, add_stream_id, get_stream_id, parse_channel,
+    parse_stream_id
+)
+from musette.websockets.sendqueue import DROP, SendQueue
+from musette.websockets.subscriber import RedisClient, RedisSubscriber
 
+# Handlers connected, by id of user and by id of topic
+clients_notifications = {}
+clients_comments = {}
 
-def redis_listener_notification():
+# Subscriber of redis of the process
+subscriber = None
+
+# Milliseconds that the comments of one topic are grouped in one frame.
+# If is 0, each comment is sent in one frame
+batch_window = 0
+
+# Comments waiting the end of the window, by id of topic
+pending_comments = {}
+
+# Connection to redis for update the presence of the users
+redis_client = None
+
+# Seconds between each update of the presence of the users connected
+PRESENCE_HEARTBEAT = 60
+
+# Seconds that the last time seen of the users is kept
+PRESENCE_RETENTION = 60 * 60 * 24 * 7
+
+# Maximum of events sent to one client that reconnect
+REPLAY_LIMIT = 1000
+
+
+def add_client(clients, key, handler, channel=None):
     """
-    This method subscribe to redis and send message
-    to handler websocket notifications
+    This method add one handler to the routing table. With the first
+    handler of the key, subscribe to its channel
     """
-    r = redis.Redis()
-    ps = r.pubsub()
-    ps.subscribe('notifications')
-    io_loop = tornado.ioloop.IOLoop.instance()
+    if key not in clients:
+        clients[key] = set()
+        if channel and subscriber is not None:
+            subscriber.subscribe(channel)
+    clients[key].add(handler)
+
 
-    # Listen notifications
-    for message in ps.listen():
-        for element in clients_notifications:
-            data = json.loads(message['data'].decode("utf-8"))
-            if 'list_us' in data:
-                users = data['list_us']
-                user = int(element.user)
-                if user in users:
-                    io_loop.add_callback(partial(element.on_message, message))
-                else:
-                    continue
+def remove_client(clients, key, handler, channel=None):
+    """
+    This method remove one handler of the routing table. With the last
+    handler of the key, unsubscribe of its channel
+    """
+    handlers = clients.get(key)
+    if handlers is not None:
+        handlers.discard(handler)
+        if not handlers:
+            del clients[key]
+            if channel and subscriber is not None:
+                subscriber.unsubscribe(channel)
 
 
-def redis_listener_comment():
+def dispatch_notification(iduser, message):
     """
-    This method subscribe to redis and send message
-    to handler websocket comments
+    This method send one notification to the handlers of the user
     """
-    r = redis.Redis()
-    ps = r.pubsub()
-    ps.subscribe('comments')
-    io_loop = tornado.ioloop.IOLoop.instance()
+    handlers = list(clients_notifications.get(iduser, ()))
+    for handler in handlers:
+        handler.send(message)
+    metrics.fanout.observe(len(handlers))
 
-    # Listen comments
-    for message in ps.listen():
-        for element in clients_comments:
-            data = json.loads(message['data'].decode("utf-8"))
-            if 'idtopic' in data:
-                idtopic = data['idtopic']
-                topic = int(element.topic)
-                if topic == idtopic:
-                    io_loop.add_callback(partial(element.on_message, message))
-                else:
-                    continue
+
+def dispatch_comment(idtopic, message):
+    """
+    This method send one comment to the handlers of the topic
+    """
+    handlers = list(clients_comments.get(idtopic, ()))
+    for handler in handlers:
+        handler.send(message)
+    metrics.fanout.observe(len(handlers))
+
+
+def batch_comment(idtopic, message):
+    """
+    This method add one comment to the frame of the topic, that
+    is sent at the end of the window
+    """
+    if idtopic not in pending_comments:
+        pending_comments[idtopic] = []
+        tornado.ioloop.IOLoop.current().call_later(
+            batch_window / 1000.0, flush_comments, idtopic
+        )
+    pending_comments[idtopic].append(message)
+
+
+def flush_comments(idtopic):
+    """
+    This method send the comments of the window in one json array
+    """
+    messages = pending_comments.pop(idtopic, [])
+    if messages:
+        dispatch_comment(idtopic, b'[' + b','.join(messages) + b']')
+        for message in messages:
+            metrics.observe_latency(message)
+
+
+def on_redis_message(channel, message):
+    """
+    This method send one message of redis to the handlers of its channel
+    """
+    metrics.counters['messages_received'] += 1
+
+    kind, key = parse_channel(channel)
+    if kind == 'user':
+        dispatch_notification(key, message)
+        metrics.observe_latency(message)
+    elif kind == 'topic':
+        if batch_window:
+            batch_comment(key, message)
+        else:
+            dispatch_comment(key, message)
+            metrics.observe_latency(message)
+
+
+def touch_presence(handlers):
+    """
+    This method set now like the last time seen of the users of the
+    handlers, in all the forum and in their forum
+    """
+    if redis_client is None or not handlers:
+        return
+
+    now = time.time()
+    commands = []
+    for iduser, idforum in set((h.user, h.forum) for h in handlers):
+        commands.append(('ZADD', PRESENCE_KEY, now, iduser))
+        if idforum:
+            commands.append((
+                'ZADD', PRESENCE_FORUM_KEY % idforum, now, iduser
+            ))
+
+    tornado.ioloop.IOLoop.current().spawn_callback(
+        redis_client.execute_many, commands
+    )
+
+
+def heartbeat_presence():
+    """
+    This method update the presence of all the users connected and
+    remove the users not seen in the retention time
+    """
+    handlers = [h for hs in clients_notifications.values() for h in hs]
+    touch_presence(handlers)
+
+    if redis_client is not None:
+        old = time.time() - PRESENCE_RETENTION
+        commands = [('ZREMRANGEBYSCORE', PRESENCE_KEY, '-inf', old)]
+        for idforum in set(h.forum for h in handlers if h.forum):
+            commands.append((
+                'ZREMRANGEBYSCORE', PRESENCE_FORUM_KEY % idforum, '-inf', old
+            ))
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            redis_client.execute_many, commands
+        )
 
 
 class RealtimeHandler(tornado.websocket.WebSocketHandler):
     """
     Handler websocket
     """
+    # Messages in msgpack, selected with the subprotocol
+    binary = False
+
     def check_origin(self, origin):
         return True
 
+    def select_subprotocol(self, subprotocols):
+        if encoding.MSGPACK_PROTOCOL in subprotocols and \
+                encoding.is_available():
+            self.binary = True
+            return encoding.MSGPACK_PROTOCOL
+        return None
+
+    def get_compression_options(self):
+        # permessage-deflate, if the client support it
+        if self.settings.get('compression'):
+            return {}
+        return None
+
     def open(self):
+        # Messages pending while the client is receiving other
+        self.queue = SendQueue(
+            self.settings.get('queue_size', 100),
+            self.settings.get('slow_policy', DROP)
+        )
+        self.writing = False
+        self.replaying = False
+
         self.user = self.get_argument('user', None)
         self.topic = self.get_argument('topic', None)
+        self.forum = self.get_argument('forum', None)
 
-        if self.user:
-            print('New connection was opened. User: ' + self.user)
-            clients_notifications.append(self)
-        elif self.topic:
-            print('New connection was opened. Topic: ' + self.topic)
-            clients_comments.append(self)
+        # Last event received by the client before reconnect
+        last_id = self.get_argument('last_id', None)
+
+        try:
+            if last_id:
+                parse_stream_id(last_id)
+
+            if self.user:
+                self.user = int(self.user)
+                self.forum = int(self.forum) if self.forum else None
+                print('New connection was opened. User: ' + str(self.user))
+                channel = USER_CHANNEL % self.user
+                add_client(clients_notifications, self.user, self, channel)
+                touch_presence([self])
+            elif self.topic:
+                self.topic = int(self.topic)
+                print('New connection was opened. Topic: ' + str(self.topic))
+                channel = TOPIC_CHANNEL % self.topic
+                add_client(clients_comments, self.topic, self, channel)
+            else:
+                return
+        except ValueError:
+            self.user = self.topic = self.forum = None
+            self.close()
+            return
+
+        if last_id:
+            self.replay(channel, last_id)
+
+    @tornado.gen.coroutine
+    def replay(self, channel, last_id):
+        """
+        Send the events of the channel after last_id. The new events
+        received meanwhile are sent after them
+        """
+        if redis_client is None:
+            return
+
+        self.replaying = True
+        self.pending = []
+
+        replies = yield redis_client.execute_many([
+            ('XRANGE', STREAM_KEY % channel, last_id, '+',
+             'COUNT', REPLAY_LIMIT)
+        ])
+
+        last_sent = parse_stream_id(last_id)
+        if replies and not isinstance(replies[0], Exception):
+            for stream_id, fields in replies[0]:
+                if parse_stream_id(stream_id) > last_sent:
+                    data = dict(zip(fields[::2], fields[1::2]))[b'data']
+                    if not self.queue.push(add_stream_id(stream_id, data)):
+                        self.slow_consumer()
+                        return
+                    last_sent = parse_stream_id(stream_id)
+
+        # Events received during the replay, without the sent
+        self.replaying = False
+        pending, self.pending = self.pending, []
+        for message in pending:
+            stream_id = get_stream_id(message)
+            if stream_id is None or stream_id > last_sent:
+                if not self.queue.push(message):
+                    self.slow_consumer()
+                    return
+
+        if not self.writing and self.queue:
+            self.write_frame(self.queue.pop())
 
     def on_message(self, message):
-        self.write_message(message['data'])
+        # The clients only receive messages
+        pass
+
+    def send(self, message):
+        if self.replaying:
+            self.pending.append(message)
+        elif not self.writing:
+            self.write_frame(message)
+        elif not self.queue.push(message):
+            self.slow_consumer()
+
+    def slow_consumer(self):
+        """
+        Close the client, not send more messages while it is closed
+        """
+        self.replaying = False
+        self.remove()
+        self.close(1008, 'Slow consumer')
+
+    def write_frame(self, message):
+        if self.binary:
+            message = encoding.to_msgpack(message)
+
+        try:
+            # The future is done when the frame is written to the socket
+            future = self.write_message(message, binary=self.binary)
+        except (tornado.websocket.WebSocketClosedError, StreamClosedError):
+            return
+
+        if not isinstance(message, bytes):
+            message = message.encode('utf-8')
+        metrics.counters['frames_sent'] += 1
+        metrics.counters['bytes_sent'] += len(message)
+        self.writing = True
+        tornado.ioloop.IOLoop.current().add_future(future, self.on_write)
+
+    def on_write(self, future):
+        self.writing = False
+        if future.exception() is None and self.queue:
+            self.write_frame(self.queue.pop())
 
     def on_close(self):
         print('Conn closed...')
+        self.remove()
+
+    def remove(self):
+        """
+        Remove the handler of the routing tables
+        """
         if self.user:
-            clients_notifications.remove(self)
+            touch_presence([self])
+            remove_client(
+                clients_notifications, self.user, self,
+                USER_CHANNEL % self.user
+            )
         elif self.topic:
-            clients_comments.remove(self)
+            remove_client(
+                clients_comments, self.topic, self,
+                TOPIC_CHANNEL % self.topic
+            )
 
 
-# Settings for server tornado
-settings = {
-    'auto_reload': True,
-}
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    Handler with the metrics of the process in json. With more than one
+    worker each process has its counters, see run
+    """
+    def get(self):
+        notifications = clients_notifications.values()
+        comments = clients_comments.values()
 
-# Routes application tornado
-application = tornado.web.Application([
-    (r'/ws/', RealtimeHandler),
-], **settings)
+        self.write({
+            'pid': os.getpid(),
+            'worker': tornado.process.task_id(),
+            'clients': {
+                'notifications': sum(len(h) for h in notifications),
+                'comments': sum(len(h) for h in comments),
+                'users': len(clients_notifications),
+                'topics': len(clients_comments)
+            },
+            'messages_received': metrics.counters['messages_received'],
+            'frames_sent': metrics.counters['frames_sent'],
+            # Before the compression with permessage-deflate
+            'bytes_sent_uncompressed': metrics.counters['bytes_sent'],
+            'slow_clients': sendqueue.stats,
+            'fanout': metrics.fanout.as_dict(),
+            'latency': metrics.latency.as_dict()
+        })
 
 
-if __name__ == "__main__":
-    # Thread for function redis_listener_notification
-    threading.Thread(target=redis_listener_notification).start()
-    # Thread for function redis_listener_comment
-    threading.Thread(target=redis_listener_comment).start()
-    # Run server tornado
+def make_application(autoreload=False, queue_size=100, slow_policy=DROP,
+                     compression=False):
+    """
+    This method return the application tornado with the routes
+    """
+    return tornado.web.Application([
+        (r'/ws/', RealtimeHandler),
+        (r'/metrics/', MetricsHandler),
+    ], autoreload=autoreload, queue_size=queue_size, slow_policy=slow_policy,
+        compression=compression)
+
+
+def make_metrics_application():
+    """
+    This method return the application tornado with only the metrics
+    """
+    return tornado.web.Application([
+        (r'/metrics/', MetricsHandler),
+    ])
+
+
+def run(port=8888, address='', workers=1, autoreload=False,
+        redis_options=None, queue_size=100, slow_policy=DROP, window=0,
+        compression=False, metrics_port=None):
+    """
+    This method run the server tornado. With more than one worker,
+    the processes are forked and share the socket. redis_options are
+    the host, port, password and db of redis. queue_size is the maximum of
+    messages pending for each client and slow_policy what to do when the
+    queue is full. window are the milliseconds of the batches of comments
+    and compression enable permessage-deflate. The metrics of the shared
+    socket are of the process that accept the request, with metrics_port
+    each process has also its metrics in metrics_port + number of worker
+    """
+    global batch_window, subscriber, redis_client
+    batch_window = window
+
+    sockets = tornado.netutil.bind_sockets(port, address=address)
+    if workers != 1:
+        tornado.process.fork_processes(workers)
+
+    application = make_application(
+        autoreload, queue_size, slow_policy, compression
+    )
     http_server = tornado.httpserver.HTTPServer(application)
-    http_server.listen(8888)
-    tornado.ioloop.IOLoop.instance().start()
+    http_server.add_sockets(sockets)
+
+    if metrics_port:
+        metrics_server = tornado.httpserver.HTTPServer(
+            make_metrics_application()
+        )
+        metrics_server.listen(
+            metrics_port + (tornado.process.task_id() or 0), address
+        )
+
+    # Subscribe to redis in the ioloop, the channels are added
+    # when the clients are connected
+    # The channels are not of one database, only the client select it
+    options = dict(redis_options or {})
+    options.pop('db', None)
+    subscriber = RedisSubscriber([], on_redis_message, **options)
+    io_loop = tornado.ioloop.IOLoop.current()
+    io_loop.add_callback(subscriber.run)
+
+    # Presence of the users connected
+    redis_client = RedisClient(**(redis_options or {}))
+    tornado.ioloop.PeriodicCallback(
+        heartbeat_presence, PRESENCE_HEARTBEAT * 1000
+    ).start()
+
+    io_loop.start()
+
+
+if __name__ == "__main__":
+    run(autoreload=True)
@@ -0,0 +1,212 @@
+from __future__ import print_function
+
+import socket
+
+from tornado import gen, locks
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+
+CRLF = b'\r\n'
+
+
+class RedisError(Exception):
+    """
+    Error reply of redis
+    """
+    pass
+
+
+def pack_command(*args):
+    """
+    This method return one command of redis in the protocol RESP
+    """
+    command = [b'*' + str(len(args)).encode('utf-8') + CRLF]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode('utf-8')
+        command.append(b'$' + str(len(arg)).encode('utf-8') + CRLF)
+        command.append(arg + CRLF)
+    return b''.join(command)
+
+
+@gen.coroutine
+def read_reply(stream):
+    """
+    This method read one reply of redis of the stream
+    """
+    line = yield stream.read_until(CRLF)
+    kind, value = line[:1], line[1:-2]
+
+    if kind == b'+':
+        raise gen.Return(value)
+    elif kind == b'-':
+        raise RedisError(value.decode('utf-8'))
+    elif kind == b':':
+        raise gen.Return(int(value))
+    elif kind == b'$':
+        length = int(value)
+        if length == -1:
+            raise gen.Return(None)
+        data = yield stream.read_bytes(length + 2)
+        raise gen.Return(data[:-2])
+    elif kind == b'*':
+        length = int(value)
+        if length == -1:
+            raise gen.Return(None)
+        reply = []
+        for i in range(length):
+            item = yield read_reply(stream)
+            reply.append(item)
+        raise gen.Return(reply)
+    else:
+        raise RedisError('Invalid reply: %r' % line)
+
+
+class RedisSubscriber(object):
+    """
+    Subscriber of channels of redis that runs in the ioloop of tornado.
+    If the connection is lost, it reconnect and subscribe again. The
+    channels are not of one database, it has not SELECT
+    """
+    def __init__(self, channels, on_message, host='localhost', port=6379,
+                 password=None, reconnect_delay=1):
+        self.channels = set(channels)
+        self.on_message = on_message
+        self.host = host
+        self.port = port
+        self.password = password
+        self.reconnect_delay = reconnect_delay
+        self.stream = None
+        # If the AUTH was replied, before the commands are not sent
+        self.ready = False
+        self.running = False
+
+    @gen.coroutine
+    def connect(self):
+        """
+        Open the connection and subscribe to the channels, also the
+        channels added meanwhile
+        """
+        self.stream = yield TCPClient().connect(self.host, self.port)
+
+        if self.password:
+            yield self.stream.write(pack_command('AUTH', self.password))
+            yield read_reply(self.stream)
+
+        self.ready = True
+        if self.channels:
+            yield self.stream.write(
+                pack_command('SUBSCRIBE', *self.channels)
+            )
+
+    @gen.coroutine
+    def listen(self):
+        """
+        Read the messages of the channels until the connection is closed
+        """
+        while True:
+            reply = yield read_reply(self.stream)
+            if reply[0] == b'message':
+                self.on_message(reply[1].decode('utf-8'), reply[2])
+
+    @gen.coroutine
+    def run(self):
+        """
+        Keep the subscription while the subscriber is running
+        """
+        self.running = True
+        while self.running:
+            try:
+                yield self.connect()
+                print('Connected to redis')
+                yield self.listen()
+            except (StreamClosedError, socket.error, RedisError) as e:
+                print('Connection to redis lost: ' + str(e))
+            finally:
+                self.ready = False
+                if self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+
+            if self.running:
+                yield gen.sleep(self.reconnect_delay)
+
+    def is_connected(self):
+        return self.ready and not self.stream.closed()
+
+    def subscribe(self, *channels):
+        """
+        Add channels to the subscription
+        """
+        self.channels.update(channels)
+        if self.is_connected():
+            self.stream.write(pack_command('SUBSCRIBE', *channels))
+
+    def unsubscribe(self, *channels):
+        """
+        Remove channels of the subscription
+        """
+        self.channels.difference_update(channels)
+        if self.is_connected():
+            self.stream.write(pack_command('UNSUBSCRIBE', *channels))
+
+    def stop(self):
+        self.running = False
+        if self.stream is not None:
+            self.stream.close()
+
+
+class RedisClient(object):
+    """
+    Connection to redis for send commands from the ioloop of tornado
+    """
+    def __init__(self, host='localhost', port=6379, password=None, db=0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.stream = None
+        self.lock = locks.Lock()
+
+    @gen.coroutine
+    def connect(self):
+        self.stream = yield TCPClient().connect(self.host, self.port)
+        if self.password:
+            yield self.stream.write(pack_command('AUTH', self.password))
+            yield read_reply(self.stream)
+
+        # The same database of django, for the streams and the presence
+        if self.db:
+            yield self.stream.write(pack_command('SELECT', self.db))
+            yield read_reply(self.stream)
+
+    @gen.coroutine
+    def execute_many(self, commands):
+        """
+        Send the commands in one round trip. Return the replies (the
+        errors of redis are returned like RedisError), or None if
+        redis is not available
+        """
+        with (yield self.lock.acquire()):
+            try:
+                if self.stream is None or self.stream.closed():
+                    yield self.connect()
+
+                yield self.stream.write(
+                    b''.join(pack_command(*command) for command in commands)
+                )
+
+                replies = []
+                for command in commands:
+                    try:
+                        reply = yield read_reply(self.stream)
+                    except RedisError as e:
+                        reply = e
+                    replies.append(reply)
+            except (StreamClosedError, socket.error, RedisError):
+                if self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+                raise gen.Return(None)
+
+        raise gen.Return(replies)
@@ -30,8 +30,8 @@ setup(
     author='Peveri Martin',
     author_email='martinpeveri@gmail.com',
     install_requires=[
-        'Django>=1.8',
-        'tornado==4.2',
+        'Django>=1.11',
+        'tornado==4.3',
         'django-redis-cache==1.6.5',
         'djangorestframework==3.5.3',
         'django-endless-pagination-vue==1.3',
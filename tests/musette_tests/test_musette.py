@@ -1,11 +1,69 @@
+import logging
+import sys
+import warnings
+from datetime import timedelta
+from logging.handlers import BufferingHandler
+from unittest import skipUnless
+
+import redis
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
 from django.utils import timezone
 
+from hitcount.models import BlacklistUserAgent, HitCount
+from tornado import gen, ioloop
+from tornado.concurrent import Future
+
+from musette import settings as localSettings, suggestions
+from musette.hits import (
+    HITS_FLUSHING, count_hit, exclude_hit, flush_hits, get_hits
+)
 from musette.models import (
-    Category, Comment, Forum,
-    Notification, Topic, Register
+    Category, Comment, Configuration, Forum,
+    Notification, Topic, TopicParticipant, Register
+)
+from musette.middleware import ActiveUserMiddleware
+from musette.notifications import (
+    NOTIFICATIONS_ATTEMPTS, NOTIFICATIONS_FAILED, NOTIFICATIONS_MAX_ATTEMPTS,
+    NOTIFICATIONS_PROCESSING, NOTIFICATIONS_QUEUE, UNREAD_KEY,
+    add_unread_notifications, clear_unread_notifications,
+    create_notifications, enqueue_notifications, get_unread_notifications,
+    load_snapshots, make_snapshot, process_notifications,
+    reset_unread_notifications, send_notifications
+)
+from musette.presence import is_online
+from musette.realtime import get_current_stream_id, send_events
+from musette.search import (
+    SEARCH_TABLE, get_backend, get_document_id, search_topics, update_documents
+)
+from musette.templatetags.forum_tags import get_item_notification
+from musette.utils import (
+    get_configuration, get_forums_index, get_redis_connection,
+    get_users_topic, get_photo_profile, get_photos_profile
 )
+from musette.websockets import encoding, server
+from musette.websockets.channels import (
+    STREAM_KEY, TOPIC_CHANNEL, USER_CHANNEL, add_stream_id, get_stream_id,
+    parse_stream_id
+)
+from musette.websockets.metrics import Histogram
+from musette.websockets.sendqueue import (
+    COALESCE, DISCONNECT, DROP, SendQueue
+)
+from musette.websockets.subscriber import (
+    RedisClient, RedisSubscriber, pack_command
+)
+from musette_tests.models import Profile
 
 
 class CreateTopicTestCase(TestCase):
@@ -121,3 +179,800 @@ class DeleteNotificationTopicTestCase(TestCase):
         Register.objects.filter(
             user_id=1, forum_id=1,
         ).delete()
+
+
+class TopicCountersTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(
+            name="Backend", position=0, hidden=False
+        )
+        self.forum = Forum.objects.create(
+            category=category, parent=None, name="Django",
+            position=0, description="Test forum",
+            topics_count=0, hidden=False, is_moderate=False
+        )
+
+        User = get_user_model()
+        self.john = User.objects.create_user(
+            'john', 'lennon@thebeatles.com', 'johnpassword'
+        )
+        self.paul = User.objects.create_user(
+            'paul', 'paul@thebeatles.com', 'paulpassword'
+        )
+
+        self.topic = Topic.objects.create(
+            forum=self.forum, user=self.john, title="test",
+            date=timezone.now(), description="Test topic create",
+            id_attachment="", attachment="", moderate=True
+        )
+
+    def add_comment(self, user):
+        return Comment.objects.create(
+            topic=self.topic, user=user, date=timezone.now(),
+            description="Comment tests"
+        )
+
+    def test_add_comments(self):
+        self.add_comment(self.john)
+        self.add_comment(self.paul)
+        last = self.add_comment(self.john)
+
+        topic = Topic.objects.get(idtopic=self.topic.idtopic)
+        self.assertEqual(topic.comments_count, 3)
+        self.assertEqual(topic.participants_count, 2)
+        self.assertEqual(topic.last_comment_id, last.idcomment)
+        self.assertEqual(topic.last_comment_user_id, self.john.id)
+
+    def test_delete_comments(self):
+        first = self.add_comment(self.john)
+        last = self.add_comment(self.paul)
+        Comment.objects.filter(idcomment=last.idcomment).delete()
+
+        topic = Topic.objects.get(idtopic=self.topic.idtopic)
+        self.assertEqual(topic.comments_count, 1)
+        self.assertEqual(topic.participants_count, 1)
+        self.assertEqual(topic.last_comment_id, first.idcomment)
+
+        first.delete()
+        topic = Topic.objects.get(idtopic=self.topic.idtopic)
+        self.assertEqual(topic.comments_count, 0)
+        self.assertEqual(topic.participants_count, 0)
+        self.assertIsNone(topic.last_comment_id)
+
+    def test_save_topic_keep_counters(self):
+        self.add_comment(self.paul)
+        self.topic.title = "test update"
+        self.topic.save()
+
+        topic = Topic.objects.get(idtopic=self.topic.idtopic)
+        self.assertEqual(topic.comments_count, 1)
+
+    def test_forum_topics_count(self):
+        forum = Forum.objects.get(idforum=self.forum.idforum)
+        self.assertEqual(forum.topics_count, 1)
+
+        Topic.objects.filter(idtopic=self.topic.idtopic).delete()
+        forum = Forum.objects.get(idforum=self.forum.idforum)
+        self.assertEqual(forum.topics_count, 0)
+
+    def test_delete_topic_with_comments(self):
+        for i in range(5):
+            self.add_comment(self.john if i % 2 else self.paul)
+
+        # The counters of the topic are not updated with each comment
+        with CaptureQueriesContext(connection) as queries:
+            self.topic.delete()
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'SET "comments_count"' in query['sql']
+        ])
+        self.assertFalse(TopicParticipant.objects.exists())
+        forum = Forum.objects.get(idforum=self.forum.idforum)
+        self.assertEqual(forum.topics_count, 0)
+
+    def test_recount(self):
+        self.add_comment(self.john)
+        last = self.add_comment(self.paul)
+        empty = Topic.objects.create(
+            forum=self.forum, user=self.john, title="empty",
+            description="Without comments"
+        )
+        Topic.objects.update(
+            comments_count=3, participants_count=0, last_comment=None,
+            last_comment_user=self.john
+        )
+        Forum.objects.update(topics_count=10)
+
+        call_command('musette_recount', stdout=StringIO())
+
+        topic = Topic.objects.get(idtopic=self.topic.idtopic)
+        self.assertEqual(topic.comments_count, 2)
+        self.assertEqual(topic.participants_count, 2)
+        self.assertEqual(topic.last_comment_id, last.idcomment)
+        self.assertEqual(topic.last_comment_user_id, self.paul.id)
+        empty = Topic.objects.get(idtopic=empty.idtopic)
+        self.assertEqual(empty.comments_count, 0)
+        self.assertIsNone(empty.last_comment_user_id)
+        forum = Forum.objects.get(idforum=self.forum.idforum)
+        self.assertEqual(forum.topics_count, 2)
+
+    def test_participants(self):
+        first = self.add_comment(self.john)
+        self.add_comment(self.paul)
+        self.add_comment(self.john)
+
+        participant = TopicParticipant.objects.get(user=self.john)
+        self.assertEqual(participant.comments_count, 2)
+        self.assertEqual(
+            get_users_topic(self.topic, self.john.id), [self.paul.id]
+        )
+
+        first.delete()
+        participant = TopicParticipant.objects.get(user=self.john)
+        self.assertEqual(participant.comments_count, 1)
+
+        Comment.objects.filter(user=self.paul).delete()
+        self.assertEqual(get_users_topic(self.topic, self.john.id), [])
+
+        TopicParticipant.objects.all().delete()
+        call_command('musette_recount', stdout=StringIO())
+        participant = TopicParticipant.objects.get(user=self.john)
+        self.assertEqual(participant.comments_count, 1)
+
+
+class ForumsIndexTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(
+            name="Backend", position=0, hidden=False
+        )
+        hidden = Category.objects.create(
+            name="Hidden", position=1, hidden=True
+        )
+
+        User = get_user_model()
+        self.john = User.objects.create_user(
+            'john', 'lennon@thebeatles.com', 'johnpassword'
+        )
+        self.paul = User.objects.create_user(
+            'paul', 'paul@thebeatles.com', 'paulpassword'
+        )
+
+        self.django = Forum.objects.create(
+            category=category, name="Django", is_moderate=True
+        )
+        self.django.moderators.add(self.paul)
+        Forum.objects.create(
+            category=category, parent=self.django, name="Django REST"
+        )
+        Forum.objects.create(category=category, name="Flask")
+        Forum.objects.create(category=hidden, name="Secret")
+
+        Register.objects.create(user=self.john, forum=self.django)
+        Topic.objects.create(
+            forum=self.django, user=self.john, title="test",
+            description="Test topic pending"
+        )
+
+    def test_forums_index(self):
+        with self.assertNumQueries(5):
+            categories = get_forums_index()
+
+        self.assertEqual(len(categories), 1)
+        forums = categories[0].forums
+        self.assertEqual([f.name for f in forums], ["Django", "Flask"])
+        self.assertEqual([f.name for f in forums[0].childs], ["Django REST"])
+        self.assertEqual(forums[0].tot_users, 2)
+        self.assertEqual(forums[0].tot_pending_moderate, 1)
+        self.assertEqual(forums[0].moderators_ids, [self.paul.id])
+
+
+@override_settings(STATIC_URL='/static/', MEDIA_URL='/media/')
+class PhotosProfileTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(
+                name, name + '@thebeatles.com', 'password'
+            ) for name in ('john', 'paul', 'george')
+        ]
+
+    def test_photos_batch(self):
+        ids = [user.id for user in self.users]
+        Profile.objects.filter(iduser=self.users[0]).update(
+            photo="profiles/john.png"
+        )
+
+        with self.assertNumQueries(1):
+            photos = get_photos_profile(ids)
+        with self.assertNumQueries(0):
+            get_photos_profile(ids)
+
+        self.assertEqual(
+            photos[self.users[0].id],
+            settings.MEDIA_URL + "profiles/john.png"
+        )
+        self.assertEqual(photos[self.users[1].id], photos[self.users[2].id])
+
+    def test_photo_invalidation(self):
+        iduser = self.users[0].id
+        default_photo = get_photo_profile(iduser)
+
+        profile = Profile.objects.get(iduser=iduser)
+        profile.photo = "profiles/john.png"
+        profile.save()
+
+        self.assertNotEqual(get_photo_profile(iduser), default_photo)
+
+
+class TopicViewsTestCase(TestCase):
+
+    def test_get_hits(self):
+        category = Category.objects.create(name="Backend")
+        forum = Forum.objects.create(category=category, name="Django")
+        User = get_user_model()
+        user = User.objects.create_user(
+            'john', 'lennon@thebeatles.com', 'johnpassword'
+        )
+        topics = [
+            Topic.objects.create(
+                forum=forum, user=user, title="test",
+                description="Test topic"
+            ) for i in range(3)
+        ]
+        hitcount = HitCount.objects.get_for_object(topics[0])
+        hitcount.hits = 5
+        hitcount.save()
+
+        ids = [topic.idtopic for topic in topics]
+        with self.assertNumQueries(1):
+            hits = get_hits(Topic, ids)
+
+        self.assertEqual(hits[topics[0].idtopic], 5)
+        self.assertEqual(hits[topics[1].idtopic], 0)
+
+
+# Database of redis of the settings of the tests, its keys are removed
+TEST_REDIS_DB = 15
+
+
+def is_redis_available():
+    r = get_redis_connection()
+    if r.connection_pool.connection_kwargs.get('db') != TEST_REDIS_DB:
+        return False
+    try:
+        return r.ping()
+    except redis.ConnectionError:
+        return False
+
+
+@skipUnless(is_redis_available(), 'redis is not available')
+class HitsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Backend")
+        forum = Forum.objects.create(category=category, name="Django")
+        self.hitcount = HitCount.objects.get_for_object(forum)
+
+        self.r = get_redis_connection()
+        keys = list(self.r.scan_iter('musette:hits:*'))
+        if keys:
+            self.r.delete(*keys)
+
+    def test_flush_hits(self):
+        self.assertTrue(count_hit(self.hitcount.pk, "user_1"))
+        self.assertFalse(count_hit(self.hitcount.pk, "user_1"))
+        self.assertTrue(count_hit(self.hitcount.pk, "user_2"))
+
+        self.assertEqual(flush_hits(), 1)
+        self.assertEqual(HitCount.objects.get(pk=self.hitcount.pk).hits, 2)
+
+        # The hits of a flush interrupted are saved one time
+        self.r.hset(HITS_FLUSHING, self.hitcount.pk, 3)
+        self.assertEqual(flush_hits(), 1)
+        self.assertEqual(flush_hits(), 0)
+        self.assertEqual(HitCount.objects.get(pk=self.hitcount.pk).hits, 5)
+
+    @override_settings(HITCOUNT_HITS_PER_IP_LIMIT=1)
+    def test_exclude_hit(self):
+        request = RequestFactory().post(
+            '/hit/', REMOTE_ADDR='10.0.0.1', HTTP_USER_AGENT='Test'
+        )
+        request.user = AnonymousUser()
+        self.assertIsNone(exclude_hit(request))
+
+        count_hit(self.hitcount.pk, "user_1", '10.0.0.1')
+        self.assertEqual(
+            exclude_hit(request),
+            "Not counted: hits per IP address limit reached"
+        )
+
+        BlacklistUserAgent.objects.create(user_agent='Test')
+        self.assertEqual(
+            exclude_hit(request),
+            "Not counted: user agent has been blacklisted"
+        )
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Backend")
+        self.forum = Forum.objects.create(category=category, name="Django")
+        User = get_user_model()
+        self.user = User.objects.create_user(
+            'john', 'lennon@thebeatles.com', 'johnpassword'
+        )
+        self.topic = Topic.objects.create(
+            forum=self.forum, user=self.user, title="Deploy with nginx",
+            description="<p>How configure the server</p>"
+        )
+        self.other = Topic.objects.create(
+            forum=self.forum, user=self.user, title="Templates",
+            description="<p>Inheritance of templates</p>"
+        )
+
+    def test_search(self):
+        self.assertEqual(search_topics('nginx', self.forum.idforum),
+                         [self.topic.idtopic])
+        self.assertEqual(search_topics('configure', self.forum.idforum),
+                         [self.topic.idtopic])
+        self.assertEqual(search_topics('p', self.forum.idforum), [])
+
+        comment = Comment.objects.create(
+            topic=self.other, user=self.user,
+            description="With nginx in front of gunicorn"
+        )
+        self.assertEqual(search_topics('nginx', self.forum.idforum),
+                         [self.topic.idtopic, self.other.idtopic])
+
+        comment.delete()
+        self.topic.delete()
+        self.assertEqual(search_topics('nginx', self.forum.idforum), [])
+
+    def test_index_error(self):
+        # Without the table of the index the topics are saved
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE " + SEARCH_TABLE)
+        logger = logging.getLogger('musette.search')
+        handler = BufferingHandler(10)
+        logger.addHandler(handler)
+        try:
+            topic = Topic.objects.create(
+                forum=self.forum, user=self.user, title="Without index",
+                description="Test topic"
+            )
+        finally:
+            logger.removeHandler(handler)
+        self.assertTrue(Topic.objects.filter(idtopic=topic.idtopic).exists())
+        self.assertEqual(len(handler.buffer), 1)
+
+    def test_update_documents(self):
+        get_backend().clear()
+        ids = [get_document_id(self.topic), get_document_id(self.other) + 2]
+        update_documents(ids)
+        self.assertEqual(search_topics('nginx', self.forum.idforum),
+                         [self.topic.idtopic])
+
+    def test_rebuild_index(self):
+        call_command('musette_rebuild_index', stdout=StringIO())
+        self.assertEqual(search_topics('inheritance', self.forum.idforum),
+                         [self.other.idtopic])
+
+
+class SuggestionsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Backend")
+        forum = Forum.objects.create(category=category, name="Django")
+        User = get_user_model()
+        self.user = User.objects.create_user(
+            'john', 'lennon@thebeatles.com', 'johnpassword'
+        )
+        self.forum = forum
+        cache.clear()
+        if is_redis_available():
+            suggestions.rebuild()
+
+    def add_topic(self, title):
+        topic = Topic.objects.create(
+            forum=self.forum, user=self.user, title=title, description="x"
+        )
+        suggestions.update_topic(topic.idtopic, topic.title)
+        return topic
+
+    def test_terms(self):
+        self.assertEqual(
+            suggestions.get_terms(
+                "How to deploy the Django app with Nginx and nginx"
+            ),
+            ['app', 'deploy', 'django', 'nginx']
+        )
+
+    @skipUnless(is_redis_available(), 'redis is not available')
+    def test_suggestions(self):
+        nginx = self.add_topic("Deploy django with nginx")
+        config = self.add_topic("Nginx config for django")
+        self.assertEqual(suggestions.get_suggestions(nginx), [config.idtopic])
+        self.assertEqual(suggestions.get_suggestions(config), [nginx.idtopic])
+
+        # The list of the similar topic is computed again
+        flask = self.add_topic("Deploy flask with gunicorn")
+        self.assertEqual(
+            suggestions.get_suggestions(nginx),
+            [config.idtopic, flask.idtopic]
+        )
+        self.assertEqual(suggestions.get_suggestions(config), [nginx.idtopic])
+
+        suggestions.update_topic(config.idtopic, "Templates")
+        self.assertEqual(suggestions.get_suggestions(nginx), [flask.idtopic])
+
+        suggestions.remove_topic(flask.idtopic)
+        self.assertEqual(suggestions.get_suggestions(nginx), [])
+
+
+class ConfigurationCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.create(domain="musette.com", name="Musette")
+
+    def test_configuration_cache(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_configuration(self.site.id))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_configuration(self.site.id))
+
+        Configuration.objects.create(site=self.site, logo_width=100)
+        configuration = get_configuration(self.site.id)
+        self.assertEqual(configuration.logo_width, 100)
+
+
+@override_settings(STATIC_URL='/static/', MEDIA_URL='/media/')
+class NotificationSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Backend")
+        forum = Forum.objects.create(category=category, name="Django")
+        User = get_user_model()
+        self.john = User.objects.create_user(
+            'john', 'lennon@thebeatles.com', 'johnpassword'
+        )
+        self.topic = Topic.objects.create(
+            forum=forum, user=self.john, title="test",
+            description="Test topic"
+        )
+        self.content_type = ContentType.objects.get_for_model(Topic)
+
+    def add_notification(self, payload=''):
+        return Notification.objects.create(
+            iduser=self.john.id, is_view=False, idobject=self.topic.idtopic,
+            date=timezone.now(), is_topic=True, is_comment=False,
+            content_type=self.content_type, payload=payload
+        )
+
+    def test_render_snapshot(self):
+        payload = make_snapshot(self.topic, self.john, "/static/photo.png")
+        for i in range(20):
+            self.add_notification(payload)
+
+        with self.assertNumQueries(1):
+            notifications = list(Notification.objects.all())
+            load_snapshots(notifications)
+            html = [get_item_notification(n) for n in notifications]
+
+        self.assertIn("/topic/Django/test/", html[0])
+        self.assertIn("/static/photo.png", html[0])
+
+    def test_render_legacy(self):
+        for i in range(20):
+            self.add_notification()
+        get_photo_profile(self.john.id)
+
+        with self.assertNumQueries(2):
+            notifications = list(Notification.objects.all())
+            load_snapshots(notifications)
+            html = [get_item_notification(n) for n in notifications]
+
+        self.assertIn("/topic/Django/test/", html[0])
+        self.assertIn(">john</a>", html[0])
+
+    def test_send_notifications(self):
+        User = get_user_model()
+        users = [
+            User.objects.create_user(
+                name, name + '@thebeatles.com', 'password'
+            ).id for name in ('paul', 'george', 'ringo')
+        ]
+        payload = make_snapshot(self.topic, self.john, "/static/photo.png")
+
+        send_notifications(users, self.topic, payload, timezone.now())
+
+        notifications = Notification.objects.filter(idobject=self.topic.pk)
+        self.assertEqual(
+            sorted(notifications.values_list('iduser', flat=True)), users
+        )
+        self.assertTrue(all(n.is_topic for n in notifications))
+
+
+@skipUnless(is_redis_available(), 'redis is not available')
+class UnreadNotificationsTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Backend")
+        forum = Forum.objects.create(category=category, name="Django")
+        User = get_user_model()
+        self.john = User.objects.create_user(
+            'john', 'lennon@thebeatles.com', 'johnpassword'
+        )
+        self.topic = Topic.objects.create(
+            forum=forum, user=self.john, title="test",
+            description="Test topic"
+        )
+        get_redis_connection().delete(UNREAD_KEY % self.john.id)
+
+    def add_notification(self):
+        create_notifications(
+            [self.john.id], self.topic.idtopic, False, '', timezone.now()
+        )
+        # The counter is incremented when the transaction is committed
+        add_unread_notifications([self.john.id])
+
+    def test_counter(self):
+        # Without counter, it is not incremented and it is recounted
+        r = get_redis_connection()
+        self.add_notification()
+        self.assertIsNone(r.get(UNREAD_KEY % self.john.id))
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unread_notifications(self.john.id), 1)
+
+        self.add_notification()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_notifications(self.john.id), 2)
+
+        reset_unread_notifications(self.john.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_notifications(self.john.id), 0)
+
+        clear_unread_notifications([self.john.id])
+        self.assertEqual(get_unread_notifications(self.john.id), 2)
+
+    def test_queue(self):
+        r = get_redis_connection()
+        r.delete(
+            NOTIFICATIONS_QUEUE, NOTIFICATIONS_PROCESSING,
+            NOTIFICATIONS_ATTEMPTS, NOTIFICATIONS_FAILED
+        )
+        data = {
+            "idusers": [self.john.id], "idobject": self.topic.idtopic,
+            "is_comment": False, "payload": "", "date": timezone.now()
+        }
+        enqueue_notifications(data)
+        self.assertEqual(process_notifications(timeout=1), 1)
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertIsNone(process_notifications(timeout=1))
+
+        # If the notifications are not created, the item is tried again
+        # and then moved to the list of failed
+        data["idusers"] = ["john"]
+        enqueue_notifications(data)
+        logger = logging.getLogger('musette.notifications')
+        handler = BufferingHandler(10)
+        logger.addHandler(handler)
+        try:
+            for i in range(NOTIFICATIONS_MAX_ATTEMPTS):
+                self.assertEqual(r.llen(NOTIFICATIONS_QUEUE), 1)
+                self.assertEqual(process_notifications(timeout=1), 0)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(len(handler.buffer), NOTIFICATIONS_MAX_ATTEMPTS)
+        self.assertEqual(r.llen(NOTIFICATIONS_QUEUE), 0)
+        self.assertEqual(r.llen(NOTIFICATIONS_PROCESSING), 0)
+        self.assertEqual(r.llen(NOTIFICATIONS_FAILED), 1)
+        self.assertFalse(r.exists(NOTIFICATIONS_ATTEMPTS))
+
+
+class PresenceTestCase(TestCase):
+
+    def test_is_online(self):
+        now = timezone.now()
+        self.assertTrue(is_online(now))
+        self.assertFalse(is_online(now - timedelta(hours=1)))
+        self.assertFalse(is_online(None))
+
+
+class ActiveUserMiddlewareTestCase(TestCase):
+
+    def test_deprecated(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertRaises(MiddlewareNotUsed, ActiveUserMiddleware)
+        self.assertEqual(caught[0].category, DeprecationWarning)
+
+
+class WebsocketRoutingTestCase(TestCase):
+
+    class Handler(object):
+
+        def __init__(self):
+            self.messages = []
+
+        def send(self, message):
+            self.messages.append(message)
+
+    def tearDown(self):
+        server.clients_notifications.clear()
+        server.clients_comments.clear()
+
+    def test_dispatch(self):
+        john, paul, topic = self.Handler(), self.Handler(), self.Handler()
+        server.add_client(server.clients_notifications, 1, john)
+        server.add_client(server.clients_notifications, 2, paul)
+        server.add_client(server.clients_comments, 5, topic)
+
+        server.on_redis_message(USER_CHANNEL % 1, 'notification')
+        server.on_redis_message(USER_CHANNEL % 3, 'notification')
+        server.on_redis_message(TOPIC_CHANNEL % 5, 'comment')
+
+        self.assertEqual(john.messages, ['notification'])
+        self.assertEqual(paul.messages, [])
+        self.assertEqual(topic.messages, ['comment'])
+
+        server.remove_client(server.clients_notifications, 1, john)
+        self.assertNotIn(1, server.clients_notifications)
+
+    def test_batch_comments(self):
+        topic = self.Handler()
+        server.add_client(server.clients_comments, 5, topic)
+
+        server.batch_window = 100
+        try:
+            server.on_redis_message(TOPIC_CHANNEL % 5, b'{"c": 1}')
+            server.on_redis_message(TOPIC_CHANNEL % 5, b'{"c": 2}')
+            self.assertEqual(topic.messages, [])
+
+            server.flush_comments(5)
+            self.assertEqual(topic.messages, [b'[{"c": 1},{"c": 2}]'])
+        finally:
+            server.batch_window = 0
+
+    def test_histogram(self):
+        histogram = Histogram([1, 10])
+        for value in (0, 5, 20):
+            histogram.observe(value)
+
+        data = histogram.as_dict()
+        self.assertEqual(data['buckets'], {'1': 1, '10': 2})
+        self.assertEqual(data['count'], 3)
+
+    @skipUnless(is_redis_available(), 'redis is not available')
+    def test_current_stream_id(self):
+        # The events published after the render are after the id
+        stream_id = get_current_stream_id()
+        r = get_redis_connection()
+        key = STREAM_KEY % (TOPIC_CHANNEL % 0)
+        event_id = r.xadd(key, {'data': '{}'})
+        r.delete(key)
+        self.assertTrue(
+            parse_stream_id(event_id) >= parse_stream_id(stream_id)
+        )
+
+    @skipUnless(is_redis_available(), 'redis is not available')
+    def test_send_events_error(self):
+        # The errors of redis are logged, the events run after the commit
+        length = localSettings.REALTIME_STREAM_LENGTH
+        localSettings.REALTIME_STREAM_LENGTH = 'many'
+        logger = logging.getLogger('musette.realtime')
+        handler = BufferingHandler(10)
+        logger.addHandler(handler)
+        try:
+            send_events([(TOPIC_CHANNEL % 0, '{"c": 1}')])
+        finally:
+            localSettings.REALTIME_STREAM_LENGTH = length
+            logger.removeHandler(handler)
+        self.assertEqual(len(handler.buffer), 1)
+
+    def test_replay(self):
+        handler = server.RealtimeHandler.__new__(server.RealtimeHandler)
+        handler.queue = SendQueue(10, DROP)
+        handler.writing = True
+
+        class Client(object):
+
+            def execute_many(self, commands):
+                # Events published during the replay
+                handler.send(add_stream_id(b'1500-2', b'{"c": 2}'))
+                handler.send(add_stream_id(b'1500-3', b'{"c": 3}'))
+
+                future = Future()
+                future.set_result([[
+                    (b'1500-1', [b'data', b'{"c": 1}']),
+                    (b'1500-2', [b'data', b'{"c": 2}']),
+                ]])
+                return future
+
+        server.redis_client = Client()
+        try:
+            handler.replay(TOPIC_CHANNEL % 5, '1500-1')
+        finally:
+            server.redis_client = None
+
+        self.assertFalse(handler.replaying)
+        self.assertEqual(
+            [handler.queue.pop() for i in range(len(handler.queue))],
+            [b'{"stream_id": "1500-2", "c": 2}',
+             b'{"stream_id": "1500-3", "c": 3}']
+        )
+
+    @skipUnless(is_redis_available(), 'redis is not available')
+    def test_subscriber(self):
+        messages = []
+        subscriber = RedisSubscriber([], lambda c, m: messages.append(m))
+        client = RedisClient()
+
+        @gen.coroutine
+        def run():
+            ioloop.IOLoop.current().spawn_callback(subscriber.run)
+            # Subscribed while the connection is opened
+            subscriber.subscribe(TOPIC_CHANNEL % 0)
+            for i in range(50):
+                yield client.execute_many([
+                    ('PUBLISH', TOPIC_CHANNEL % 0, 'comment')
+                ])
+                if messages:
+                    break
+                yield gen.sleep(0.01)
+            subscriber.stop()
+
+        # The subscriber print the connections
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            ioloop.IOLoop.current().run_sync(run)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(messages[0], b'comment')
+
+    def test_pack_command(self):
+        self.assertEqual(
+            pack_command('SUBSCRIBE', 'comments'),
+            b'*2\r\n$9\r\nSUBSCRIBE\r\n$8\r\ncomments\r\n'
+        )
+
+    def test_stream_id(self):
+        message = add_stream_id(b'1500-2', b'{"c": 1}')
+        self.assertEqual(message, b'{"stream_id": "1500-2", "c": 1}')
+        self.assertEqual(get_stream_id(message), (1500, 2))
+        self.assertIsNone(get_stream_id(b'{"c": 1}'))
+        self.assertTrue(parse_stream_id('1500-10') > parse_stream_id('1500-9'))
+        self.assertRaises(ValueError, parse_stream_id, 'last')
+
+    @skipUnless(encoding.is_available(), 'msgpack is not installed')
+    def test_to_msgpack(self):
+        message = b'{"username": "john", "idtopic": 1}'
+        packed = encoding.to_msgpack(message)
+        self.assertEqual(
+            encoding.msgpack.unpackb(packed, raw=False),
+            {'username': 'john', 'idtopic': 1}
+        )
+        self.assertIs(encoding.to_msgpack(message), packed)
+
+    def test_send_queue(self):
+        queue = SendQueue(2, DROP)
+        for message in ('a', 'b', 'c'):
+            self.assertTrue(queue.push(message))
+        self.assertEqual([queue.pop(), queue.pop()], ['b', 'c'])
+
+        queue = SendQueue(2, COALESCE)
+        for message in ('a', 'b', 'c', 'd'):
+            self.assertTrue(queue.push(message))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.pop(), '{"coalesced": 3}')
+        self.assertEqual(queue.pop(), 'd')
+
+        queue = SendQueue(1, DISCONNECT)
+        self.assertTrue(queue.push('a'))
+        self.assertFalse(queue.push('b'))
@@ -45,4 +45,6 @@ settings.configure(
     SITE_NAME = 'Musette Forum',
     SITE_URL = 'http://localhost:800/',
     EMAIL_MUSETTE = '',
+    # Database of redis only for the tests, they remove its keys
+    MUSETTE_REDIS_URL = 'redis://localhost:6379/15',
 )
\ No newline at end of file